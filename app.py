@@ -1,28 +1,141 @@
-from flask import Flask, render_template, redirect, url_for, request, flash
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify, abort, send_file, g, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import load_only
 from werkzeug.security import generate_password_hash, check_password_hash
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import img_to_array
 import numpy as np
 from PIL import Image
+import csv
 import io
+import json
 import os
-import base64
 import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from image_store import ImageStore, sniff_mimetype
+from jobs import JobQueue, UploadSpool, WorkerPool
+from metrics import BATCH_BUCKETS, Metrics
+from model_registry import ModelManager, ModelRegistry
+from inference import ViewBudget, average_views, decode_image, preprocess_batch
+from prediction_cache import PredictionCache, content_hash, dhash
+import migrations
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'users.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'users.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLite tuning: WAL lets readers carry on while one writer commits, and
+# synchronous=NORMAL only fsyncs at checkpoints in WAL mode. busy_timeout is
+# how long a writer waits for the lock before "database is locked".
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+# One connection per request thread and job worker; SQLite has a single
+# writer, so extra connections would only queue on its lock
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite:///') and ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': 0,
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000, 'check_same_thread': False},
+    }
+# Rows deleted per transaction by /clear_history
+app.config['HISTORY_DELETE_CHUNK'] = int(os.environ.get('HISTORY_DELETE_CHUNK', 500))
+app.config['IMAGE_STORE_DIR'] = os.environ.get('IMAGE_STORE_DIR', os.path.join(basedir, 'image_store'))
+app.config['THUMBNAIL_SIZE'] = int(os.environ.get('THUMBNAIL_SIZE', 256))
+app.config['THUMBNAIL_FORMAT'] = os.environ.get('THUMBNAIL_FORMAT', 'JPEG')
+# History keeps a downscaled copy of each upload, not the full-resolution image
+app.config['HISTORY_IMAGE_MAX_SIZE'] = int(os.environ.get('HISTORY_IMAGE_MAX_SIZE', 1024))
+app.config['HISTORY_IMAGE_FORMAT'] = os.environ.get('HISTORY_IMAGE_FORMAT', 'JPEG')
+app.config['HISTORY_PAGE_SIZE'] = int(os.environ.get('HISTORY_PAGE_SIZE', 20))
+# Rows fetched per round trip while streaming /history/export
+app.config['HISTORY_EXPORT_CHUNK'] = int(os.environ.get('HISTORY_EXPORT_CHUNK', 1000))
+# Seconds the /api/stats aggregates are reused before being queried again
+app.config['STATS_CACHE_TTL'] = float(os.environ.get('STATS_CACHE_TTL', 60))
+# Comma-separated usernames allowed to aggregate every user's history (scope=all)
+app.config['STATS_ADMIN_USERS'] = [name.strip() for name in os.environ.get('STATS_ADMIN_USERS', '').split(',') if name.strip()]
+app.config['JOB_QUEUE_PATH'] = os.environ.get('JOB_QUEUE_PATH', os.path.join(basedir, 'jobs.db'))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# API uploads wait here until their job has run and are deleted afterwards;
+# finished jobs (and their results) are kept for JOB_RETENTION seconds
+app.config['JOB_SPOOL_DIR'] = os.environ.get('JOB_SPOOL_DIR', os.path.join(basedir, 'job_spool'))
+app.config['JOB_RETENTION'] = float(os.environ.get('JOB_RETENTION', 7 * 86400))
+# 'keras' serves the trained .h5 model; 'tflite' serves a quantised export
+# from export_model.py through the lightweight TFLite interpreter
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'keras')
+DEFAULT_MODEL_PATHS = {
+    'keras': 'crop_disease_model.h5',
+    'tflite': 'crop_disease_model_int8.tflite',
+}
+app.config['MODEL_PATH'] = os.environ.get('MODEL_PATH', DEFAULT_MODEL_PATHS.get(app.config['INFERENCE_BACKEND']))
+# Versioned models published by train_model.py or model_registry.py; when
+# the registry has a live version it is served instead of MODEL_PATH, and
+# promoting another version swaps to it within MODEL_RELOAD_INTERVAL seconds
+app.config['MODEL_REGISTRY_DIR'] = os.environ.get('MODEL_REGISTRY_DIR', os.path.join(basedir, 'models'))
+app.config['MODEL_RELOAD_INTERVAL'] = float(os.environ.get('MODEL_RELOAD_INTERVAL', 5))
+# Share of batches also scored by the registry's shadow version, if one is set
+app.config['MODEL_SHADOW_RATE'] = float(os.environ.get('MODEL_SHADOW_RATE', 0.1))
+# Run one dummy batch right after the model is (lazily) loaded
+app.config['MODEL_WARMUP'] = os.environ.get('MODEL_WARMUP', '1') == '1'
+app.config['MAX_BATCH_SIZE'] = int(os.environ.get('MAX_BATCH_SIZE', 32))
+# Threads used to decode, resize and encode uploaded images in parallel
+app.config['DECODE_WORKERS'] = int(os.environ.get('DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+# Coalesce images from concurrent requests into shared predict calls
+app.config['BATCHING_ENABLED'] = os.environ.get('BATCHING_ENABLED', '1') == '1'
+app.config['BATCH_MAX_WAIT_MS'] = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+# Skip inference for repeat uploads; 0 entries disables the cache and an
+# unset Hamming distance keeps it to exact byte matches
+app.config['PREDICTION_CACHE_SIZE'] = int(os.environ.get('PREDICTION_CACHE_SIZE', 1024))
+app.config['PREDICTION_CACHE_TTL'] = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+app.config['PREDICTION_CACHE_MAX_DISTANCE'] = int(os.environ['PREDICTION_CACHE_MAX_DISTANCE']) if os.environ.get('PREDICTION_CACHE_MAX_DISTANCE') else None
+# Test-time augmentation: score TTA_VIEWS views of each upload (full frame,
+# centre and corner crops, mirror images; at most 8) and average the softmax
+# outputs; 1 turns it off. Views are cut, down to one, whenever predicting
+# them is expected to take longer than TTA_LATENCY_BUDGET_MS (0: no budget).
+app.config['TTA_VIEWS'] = int(os.environ.get('TTA_VIEWS', 1))
+app.config['TTA_LATENCY_BUDGET_MS'] = float(os.environ.get('TTA_LATENCY_BUDGET_MS', 500))
+# Per-stage timings and counters on /metrics; REQUEST_TIMING_LOG also logs
+# each request's stage breakdown
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['REQUEST_TIMING_LOG'] = os.environ.get('REQUEST_TIMING_LOG', '0') == '1'
+if app.config['REQUEST_TIMING_LOG']:
+    app.logger.setLevel(logging.INFO)
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+image_store = ImageStore(
+    app.config['IMAGE_STORE_DIR'],
+    app.config['THUMBNAIL_SIZE'],
+    app.config['THUMBNAIL_FORMAT'],
+    app.config['HISTORY_IMAGE_MAX_SIZE'],
+    app.config['HISTORY_IMAGE_FORMAT'],
+)
+job_queue = JobQueue(app.config['JOB_QUEUE_PATH'])
+job_spool = UploadSpool(app.config['JOB_SPOOL_DIR'])
+
+@login_manager.unauthorized_handler
+def unauthorized():
+    if request.path.startswith('/api/'):
+        return jsonify(error='Authentication required'), 401
+    flash(login_manager.login_message)
+    return redirect(url_for('login', next=request.path))
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
@@ -36,13 +149,60 @@ def load_user(user_id):
 class PredictionHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    image_data = db.Column(db.Text, nullable=False)
+    # Legacy inline base64 image; new rows keep only image_hash into image_store
+    image_data = db.Column(db.Text, nullable=True)
+    image_hash = db.Column(db.String(64), index=True)
+    thumbnail_hash = db.Column(db.String(64), index=True)
     disease_class = db.Column(db.String(255), nullable=False)
     confidence_percent = db.Column(db.Float, nullable=False)
     pesticide_recommendation = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
+    timestamp = db.Column(db.DateTime, default=utcnow)
+    model_version = db.Column(db.String(64))
+
+    # Serves the keyset-paginated history list; the other two cover the
+    # /api/stats GROUP BY queries, per user and over a time window
+    __table_args__ = (
+        db.Index('ix_prediction_history_user_timestamp_id', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_prediction_history_user_class', 'user_id', 'disease_class', 'confidence_percent'),
+        db.Index('ix_prediction_history_timestamp_class', 'timestamp', 'disease_class', 'confidence_percent'),
+    )
+
+decode_pool = ThreadPoolExecutor(max_workers=app.config['DECODE_WORKERS'], thread_name_prefix='decode')
+view_budget = ViewBudget(app.config['TTA_VIEWS'], app.config['TTA_LATENCY_BUDGET_MS'])
+
+metrics = Metrics(app.config['METRICS_ENABLED'])
+request_count = metrics.counter('http_requests_total', 'HTTP requests by endpoint, method and status.', ('endpoint', 'method', 'status'))
+request_seconds = metrics.histogram('http_request_duration_seconds', 'HTTP request latency by endpoint.', ('endpoint',))
+images_scored = metrics.counter('images_total', 'Uploaded images scored.')
+low_confidence = metrics.counter('low_confidence_total', 'Images below the confidence threshold, reported as unknown.')
+inference_batch_images = metrics.histogram('inference_batch_images', 'Images (TTA views included) sent to the model per request.', buckets=BATCH_BUCKETS)
+tta_views = metrics.histogram('tta_views', 'Views scored per uploaded image.', buckets=tuple(range(1, 9)))
+metrics.gauge('scheduler_queue_depth', 'Images waiting for the batch scheduler.', lambda: models.live.scheduler.stats()['queue_depth'])
+metrics.gauge('scheduler_mean_batch_size', 'Mean images per coalesced predict call.', lambda: models.live.scheduler.stats()['mean_batch_size'])
+metrics.gauge('shadow_agreement_rate', 'Share of shadow-scored images where shadow and live agree.', lambda: models.stats()['agreement_rate'] or 0)
+metrics.gauge('prediction_cache_hit_rate', 'Share of lookups served from the prediction cache.', lambda: prediction_cache.stats()['hit_rate'])
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    cursor.close()
 
-model = load_model('crop_disease_model.h5')
+# Every SQL statement counts towards the 'db' stage
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if metrics.enabled:
+        conn.info['query_start'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('query_start', None)
+    if start is not None:
+        metrics.record('db', time.perf_counter() - start)
 
 CLASS_NAMES = [
     'Pepper_bell__Bacterial_spot',
@@ -62,6 +222,30 @@ CLASS_NAMES = [
     'Tomato_healthy'
 ]
 
+# Loaded on first use; see get_model() and gunicorn.conf.py for pre-fork loading.
+# PESTICIDES and DISEASE_DETAILS are keyed by CLASS_NAMES, so versions with
+# other class names are refused.
+model_registry = ModelRegistry(app.config['MODEL_REGISTRY_DIR'], CLASS_NAMES)
+models = ModelManager(
+    model_registry,
+    (app.config['INFERENCE_BACKEND'], app.config['MODEL_PATH'], CLASS_NAMES),
+    warm_up=app.config['MODEL_WARMUP'],
+    max_batch_size=app.config['MAX_BATCH_SIZE'],
+    max_wait_ms=app.config['BATCH_MAX_WAIT_MS'],
+    check_interval=app.config['MODEL_RELOAD_INTERVAL'],
+    shadow_rate=app.config['MODEL_SHADOW_RATE'],
+    on_swap=lambda served: prediction_cache.set_model(served.model.path),
+)
+prediction_cache = PredictionCache(
+    app.config['PREDICTION_CACHE_SIZE'],
+    app.config['PREDICTION_CACHE_TTL'],
+    app.config['PREDICTION_CACHE_MAX_DISTANCE'],
+    models.live.model.path,
+)
+
+CONFIDENCE_THRESHOLD = 70
+UNKNOWN_CLASS = 'Unknown or not a leaf image'
+
 PESTICIDES = {
     'Pepper_bell__Bacterial_spot': 'Use copper-based bactericides and crop rotation.',
     'Pepper_bell__healthy': 'No disease detected. No treatment required.',
@@ -188,11 +372,198 @@ DISEASE_DETAILS = {
     },
 }
 
-def preprocess_image(image):
-    image = image.resize((224, 224))
-    img_array = img_to_array(image) / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
+def history_entry(item):
+    detail = DISEASE_DETAILS.get(item.disease_class, {}) if item.disease_class != UNKNOWN_CLASS else {}
+    image_url = url_for('history_image', digest=item.image_hash) if item.image_hash else None
+    thumbnail_url = url_for('history_image', digest=item.thumbnail_hash) if item.thumbnail_hash else image_url
+    return {'item': item, 'details': detail, 'image_url': image_url, 'thumbnail_url': thumbnail_url}
+
+def encode_cursor(item):
+    return f"{item.timestamp.isoformat()}_{item.id}"
+
+def decode_cursor(cursor):
+    timestamp, _, item_id = cursor.rpartition('_')
+    return datetime.fromisoformat(timestamp), int(item_id)
+
+def history_page(user_id, before=None, per_page=None):
+    # Keyset pagination over (user_id, timestamp, id), newest first. Only the
+    # columns the list shows are loaded; image blobs stay in image_store.
+    per_page = per_page or app.config['HISTORY_PAGE_SIZE']
+    query = PredictionHistory.query.options(load_only(
+        PredictionHistory.id,
+        PredictionHistory.timestamp,
+        PredictionHistory.disease_class,
+        PredictionHistory.confidence_percent,
+        PredictionHistory.pesticide_recommendation,
+        PredictionHistory.image_hash,
+        PredictionHistory.thumbnail_hash,
+    )).filter(PredictionHistory.user_id == user_id)
+    if before:
+        timestamp, item_id = decode_cursor(before)
+        query = query.filter(db.or_(
+            PredictionHistory.timestamp < timestamp,
+            db.and_(PredictionHistory.timestamp == timestamp, PredictionHistory.id < item_id),
+        ))
+    items = query.order_by(PredictionHistory.timestamp.desc(), PredictionHistory.id.desc()).limit(per_page + 1).all()
+    next_cursor = encode_cursor(items[per_page - 1]) if len(items) > per_page else None
+    return items[:per_page], next_cursor
+
+def render_index(error=None):
+    try:
+        with metrics.stage('history_query'):
+            items, next_cursor = history_page(current_user.id, request.args.get('before'))
+    except ValueError:
+        abort(400)
+    with metrics.stage('render'):
+        history_with_details = [history_entry(item) for item in items]
+        return render_template("index.html", error=error, history=history_with_details, next_cursor=next_cursor)
+
+def get_model():
+    return models.live.model.get()
+
+def run_inference(served, batch):
+    inference_batch_images.observe(len(batch))
+    return served.predict(batch, app.config['BATCHING_ENABLED'])
+
+def predict_uploads(uploads):
+    # uploads are (image, raw bytes) pairs; cached outputs are reused and only
+    # the misses go through preprocessing and the model. Returns the outputs
+    # and the model version that produced them, whose class names index them.
+    models.check()
+    served = models.live
+    results = [None] * len(uploads)
+    keys = []
+    misses = []
+    with metrics.stage('cache_lookup'):
+        for i, (image, data) in enumerate(uploads):
+            key = f'{served.version}:{content_hash(data)}'
+            phash = dhash(image) if prediction_cache.max_distance is not None else None
+            keys.append((key, phash))
+            results[i] = prediction_cache.get(key, phash)
+            if results[i] is None:
+                misses.append(i)
+    if misses:
+        # Every view of every missed upload goes to the model as one batch
+        views = view_budget.views_for(len(misses), served.scheduler.stats()['queue_depth'])
+        tta_views.observe(views)
+        with metrics.stage('preprocess'):
+            batch = preprocess_batch([uploads[i][0] for i in misses], decode_pool, views)
+        warm = served.model.loaded
+        start = time.perf_counter()
+        with metrics.stage('predict'):
+            view_preds = run_inference(served, batch)
+        seconds = time.perf_counter() - start
+        if warm:
+            # A cold first call includes loading the model; keep it out of the estimate
+            view_budget.record(len(batch), seconds)
+        models.maybe_shadow(served, batch, view_preds, seconds)
+        preds = average_views(view_preds, views)
+        for i, probs in zip(misses, preds):
+            results[i] = probs
+            # Only full-TTA results are cached, so one scored with fewer views
+            # under load is never served once all views are affordable again
+            if views == view_budget.max_views:
+                prediction_cache.put(keys[i][0], probs, keys[i][1])
+    return results, served
+
+def decode_upload(data):
+    return decode_image(data, app.config['HISTORY_IMAGE_MAX_SIZE'])
+
+def store_history_images(image):
+    return image_store.put_image(image), image_store.put_thumbnail(image)
+
+def history_row(user_id, hashes, probs, served):
+    predicted_class, confidence, pesticide = classify(probs, served.class_names)
+    image_hash, thumbnail_hash = hashes
+    if predicted_class == UNKNOWN_CLASS:
+        low_confidence.inc()
+
+    return PredictionHistory(
+        user_id=user_id,
+        image_hash=image_hash,
+        thumbnail_hash=thumbnail_hash,
+        disease_class=predicted_class,
+        confidence_percent=round(confidence, 2),
+        pesticide_recommendation=pesticide,
+        model_version=served.version,
+    )
+
+def save_predictions(user_id, all_hashes, all_preds, served):
+    # One transaction (and one fsync) for the whole upload; the rows go out
+    # as a single multi-row INSERT
+    entries = [history_row(user_id, hashes, probs, served) for hashes, probs in zip(all_hashes, all_preds)]
+    db.session.add_all(entries)
+    db.session.commit()
+    return entries
+
+def process_uploads(user_id, datas):
+    # Decode every upload on the pool, score them together, then write the
+    # downscaled history images (again on the pool) and the history rows
+    with metrics.stage('decode'):
+        images = list(decode_pool.map(decode_upload, datas))
+    images_scored.inc(len(images))
+    all_preds, served = predict_uploads(list(zip(images, datas)))
+    with metrics.stage('store_images'):
+        all_hashes = list(decode_pool.map(store_history_images, images))
+    with metrics.stage('db_write'):
+        return save_predictions(user_id, all_hashes, all_preds, served)
+
+def prediction_json(entry, filename=None):
+    unknown = entry.disease_class == UNKNOWN_CLASS
+    return {
+        'filename': filename,
+        'history_id': entry.id,
+        'disease_class': entry.disease_class,
+        'confidence_percent': entry.confidence_percent,
+        'unknown': unknown,
+        'pesticide_recommendation': entry.pesticide_recommendation,
+        'model_version': entry.model_version,
+        'details': {} if unknown else DISEASE_DETAILS.get(entry.disease_class, {}),
+    }
+
+def run_prediction_job(payload):
+    # Worker-side half of POST /api/predict: score the stored uploads and
+    # persist them as history rows, exactly like the HTML form does. The
+    # spooled uploads go whether the job succeeds or fails.
+    try:
+        with app.app_context():
+            datas = [job_spool.get(name) for name in payload['uploads']]
+            entries = process_uploads(payload['user_id'], datas)
+            return {'results': [prediction_json(entry, filename) for entry, filename in zip(entries, payload['filenames'])]}
+    finally:
+        for name in payload['uploads']:
+            job_spool.delete(name)
+
+job_workers = WorkerPool(job_queue, run_prediction_job, app.config['JOB_WORKERS'], retention=app.config['JOB_RETENTION'])
+
+def classify(probs, class_names=CLASS_NAMES):
+    confidence = float(np.max(probs)) * 100
+    predicted_class = class_names[int(np.argmax(probs))]
+    if confidence < CONFIDENCE_THRESHOLD:
+        predicted_class = UNKNOWN_CLASS
+        pesticide = "Unable to predict. Please upload a crop leaf image only."
+    else:
+        pesticide = PESTICIDES.get(predicted_class, "No pesticide recommendation available.")
+    return predicted_class, confidence, pesticide
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    metrics.begin_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    request_count.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    request_seconds.observe(elapsed, endpoint=endpoint)
+    trace = metrics.end_trace()
+    if app.config['REQUEST_TIMING_LOG'] and trace is not None:
+        breakdown = ' '.join(f'{stage}={seconds * 1000:.1f}ms' for stage, seconds in trace.items())
+        app.logger.info("%s %s %d %.1fms %s", request.method, request.path, response.status_code, elapsed * 1000, breakdown)
+    return response
 
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
@@ -229,11 +600,249 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+@app.route('/stats/batching')
+@login_required
+def batching_stats():
+    return jsonify(models.live.scheduler.stats())
+
+@app.route('/stats/tta')
+@login_required
+def tta_stats():
+    return jsonify(view_budget.stats())
+
+@app.route('/stats/models')
+@login_required
+def model_stats():
+    return jsonify(models.stats())
+
+@app.route('/stats/cache')
+@login_required
+def cache_stats():
+    return jsonify(prediction_cache.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Unauthenticated like any Prometheus target; aggregate counts only
+    if not metrics.enabled:
+        abort(404)
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/history/images/<digest>')
+@login_required
+def history_image(digest):
+    owned = PredictionHistory.query.filter(
+        PredictionHistory.user_id == current_user.id,
+        db.or_(PredictionHistory.image_hash == digest, PredictionHistory.thumbnail_hash == digest),
+    ).first()
+    if owned is None or not image_store.exists(digest):
+        abort(404)
+    path = image_store.path_for(digest)
+    with open(path, 'rb') as f:
+        mimetype = sniff_mimetype(f.read(12))
+    # Blobs are content-addressed, so a given URL never changes
+    response = send_file(path, mimetype=mimetype, etag=digest, conditional=True, max_age=31536000)
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/predict', methods=['POST'])
+@login_required
+def api_predict():
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify(error='Please upload at least one image file.'), 400
+    datas = []
+    with metrics.stage('validate'):
+        for file in files:
+            data = file.read()
+            try:
+                Image.open(io.BytesIO(data))
+            except Exception:
+                return jsonify(error=f'{file.filename} is not a readable image.'), 400
+            datas.append(data)
+    job_id = job_queue.enqueue({
+        'user_id': current_user.id,
+        'uploads': [job_spool.put(data) for data in datas],
+        'filenames': [file.filename for file in files],
+    })
+    job_workers.start()
+    return jsonify(job_id=job_id, status='queued', status_url=url_for('api_job', job_id=job_id)), 202
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None or job['payload']['user_id'] != current_user.id:
+        return jsonify(error='Job not found.'), 404
+    job_workers.start()
+    return jsonify(
+        job_id=job['id'],
+        status=job['status'],
+        created_at=job['created_at'],
+        finished_at=job['finished_at'],
+        results=(job['result'] or {}).get('results', []),
+        error=job['error'],
+    )
+
+EXPORT_COLUMNS = ['id', 'timestamp', 'disease_class', 'confidence_percent', 'pesticide_recommendation', 'model_version', 'image_url']
+
+def export_batches(user_id):
+    # Plain column rows fetched yield_per at a time from a streaming cursor,
+    # so neither ORM objects nor the whole result set accumulate in memory
+    query = db.select(
+        PredictionHistory.id,
+        PredictionHistory.timestamp,
+        PredictionHistory.disease_class,
+        PredictionHistory.confidence_percent,
+        PredictionHistory.pesticide_recommendation,
+        PredictionHistory.model_version,
+        PredictionHistory.image_hash,
+    ).where(PredictionHistory.user_id == user_id).order_by(
+        PredictionHistory.timestamp, PredictionHistory.id,
+    ).execution_options(yield_per=app.config['HISTORY_EXPORT_CHUNK'])
+    for rows in db.session.execute(query).partitions():
+        yield [{
+            'id': row.id,
+            'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+            'disease_class': row.disease_class,
+            'confidence_percent': row.confidence_percent,
+            'pesticide_recommendation': row.pesticide_recommendation,
+            'model_version': row.model_version,
+            'image_url': url_for('history_image', digest=row.image_hash, _external=True) if row.image_hash else None,
+        } for row in rows]
+
+def export_lines(user_id, fmt):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    if fmt == 'csv':
+        writer.writeheader()
+    for records in export_batches(user_id):
+        for record in records:
+            if fmt == 'csv':
+                writer.writerow(record)
+            else:
+                buffer.write(json.dumps(record) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@app.route('/history/export')
+@login_required
+def export_history():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        abort(400)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(export_lines(current_user.id, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=prediction_history.{fmt}'},
+    )
+
+stats_cache = {}
+stats_cache_lock = threading.Lock()
+
+def cached_stats(key, compute):
+    now = time.monotonic()
+    with stats_cache_lock:
+        entry = stats_cache.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    value = compute()
+    with stats_cache_lock:
+        for stale in [k for k, (expires, _) in stats_cache.items() if expires <= now]:
+            del stats_cache[stale]
+        stats_cache[key] = (now + app.config['STATS_CACHE_TTL'], value)
+    return value
+
+def stats_filters():
+    # scope=me (default) covers the current user's history, scope=all every
+    # user's (STATS_ADMIN_USERS only); days limits it to the most recent days
+    # (0 for all time)
+    scope = request.args.get('scope', 'me')
+    days = request.args.get('days', 30, type=int)
+    if scope not in ('me', 'all') or days is None or days < 0:
+        abort(400)
+    if scope == 'all' and current_user.username not in app.config['STATS_ADMIN_USERS']:
+        abort(403)
+    user_id = current_user.id if scope == 'me' else None
+    filters = []
+    if user_id is not None:
+        filters.append(PredictionHistory.user_id == user_id)
+    if days:
+        filters.append(PredictionHistory.timestamp >= utcnow() - timedelta(days=days))
+    return (scope, user_id, days), filters
+
+@app.route('/api/stats/classes')
+@login_required
+def class_stats():
+    key, filters = stats_filters()
+
+    def compute():
+        count = db.func.count(PredictionHistory.id)
+        rows = db.session.execute(
+            db.select(PredictionHistory.disease_class, count, db.func.avg(PredictionHistory.confidence_percent))
+            .where(*filters)
+            .group_by(PredictionHistory.disease_class)
+            .order_by(count.desc())
+        ).all()
+        return [
+            {'disease_class': disease_class, 'count': n, 'mean_confidence_percent': round(mean, 2)}
+            for disease_class, n, mean in rows
+        ]
+
+    scope, _, days = key
+    return jsonify(scope=scope, days=days, classes=cached_stats(('classes',) + key, compute))
+
+@app.route('/api/stats/histogram')
+@login_required
+def histogram_stats():
+    key, filters = stats_filters()
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ('day', 'week'):
+        abort(400)
+
+    def compute():
+        period = db.func.strftime('%Y-%m-%d' if bucket == 'day' else '%Y-W%W', PredictionHistory.timestamp)
+        rows = db.session.execute(
+            db.select(period, PredictionHistory.disease_class, db.func.count(PredictionHistory.id),
+                      db.func.avg(PredictionHistory.confidence_percent))
+            .where(*filters)
+            .group_by(period, PredictionHistory.disease_class)
+            .order_by(period)
+        ).all()
+        periods = {}
+        for name, disease_class, n, mean in rows:
+            entry = periods.setdefault(name, {'period': name, 'count': 0, 'confidence_sum': 0.0, 'classes': {}})
+            entry['count'] += n
+            entry['confidence_sum'] += mean * n
+            entry['classes'][disease_class] = n
+        for entry in periods.values():
+            entry['mean_confidence_percent'] = round(entry.pop('confidence_sum') / entry['count'], 2)
+        return list(periods.values())
+
+    scope, _, days = key
+    return jsonify(scope=scope, days=days, bucket=bucket, periods=cached_stats(('histogram', bucket) + key, compute))
+
 @app.route('/clear_history', methods=['POST'])
 @login_required
 def clear_history():
-    PredictionHistory.query.filter_by(user_id=current_user.id).delete()
-    db.session.commit()
+    # Delete in short transactions so other users' writes can get the lock
+    # in between, instead of waiting behind one huge DELETE
+    digests = set()
+    while True:
+        rows = (db.session.query(PredictionHistory.id, PredictionHistory.image_hash, PredictionHistory.thumbnail_hash)
+                .filter_by(user_id=current_user.id).limit(app.config['HISTORY_DELETE_CHUNK']).all())
+        if not rows:
+            break
+        PredictionHistory.query.filter(PredictionHistory.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+        db.session.commit()
+        digests.update(digest for row in rows for digest in row[1:])
+    # Then the blobs nobody else's history still uses
+    migrations.sweep_images(db, image_store, digests)
     flash('Your prediction history has been cleared.')
     return redirect(url_for('index'))
 
@@ -246,56 +855,17 @@ def index():
             files = request.files.getlist("files")
             if not files or files[0].filename == '':
                 error = "Please upload at least one image file."
-                user_history = PredictionHistory.query.filter_by(user_id=current_user.id).order_by(PredictionHistory.timestamp.desc()).all()
-                # Prepare details
-                history_with_details = []
-                for item in user_history:
-                    detail = DISEASE_DETAILS.get(item.disease_class, {}) if item.disease_class != 'Unknown or not a leaf image' else {}
-                    history_with_details.append({'item': item, 'details': detail})
-                return render_template("index.html", error=error, history=history_with_details)
-
-            for file in files:
-                image = Image.open(file.stream).convert('RGB')
-                img_array = preprocess_image(image)
-                preds = model.predict(img_array)
-                confidence = float(np.max(preds[0])) * 100
-                predicted_class = CLASS_NAMES[np.argmax(preds[0])]
-
-                if confidence < 70:
-                    predicted_class = "Unknown or not a leaf image"
-                    pesticide = "Unable to predict. Please upload a crop leaf image only."
-                    details = {}
-                else:
-                    pesticide = PESTICIDES.get(predicted_class, "No pesticide recommendation available.")
-                    details = DISEASE_DETAILS.get(predicted_class, {})
-
-                buffered = io.BytesIO()
-                image.save(buffered, format="PNG")
-                img_str = base64.b64encode(buffered.getvalue()).decode()
-
-                new_history_entry = PredictionHistory(
-                    user_id=current_user.id,
-                    image_data=img_str,
-                    disease_class=predicted_class,
-                    confidence_percent=round(confidence, 2),
-                    pesticide_recommendation=pesticide
-                )
-                db.session.add(new_history_entry)
-                db.session.commit()
+                return render_index(error)
+
+            process_uploads(current_user.id, [file.read() for file in files])
 
         except Exception as e:
             logging.exception("Error during prediction")
             error = f"An error occurred: {str(e)}"
 
-    user_history = PredictionHistory.query.filter_by(user_id=current_user.id).order_by(PredictionHistory.timestamp.desc()).all()
-    history_with_details = []
-    for item in user_history:
-        detail = DISEASE_DETAILS.get(item.disease_class, {}) if item.disease_class != 'Unknown or not a leaf image' else {}
-        history_with_details.append({'item': item, 'details': detail})
-
-    return render_template("index.html", error=error, history=history_with_details)
+    return render_index(error)
 
 if __name__ == "__main__":
     with app.app_context():
-        db.create_all()
+        migrations.upgrade(db, image_store)
     app.run(debug=True)
@@ -0,0 +1,287 @@
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from jinja2 import ChoiceLoader, DictLoader
+from PIL import Image
+
+# Everything runs against a throwaway database, image store and a synthetic
+# model with random weights, so no trained .h5 or real users.db is needed.
+# These must be set before app is imported.
+workdir = tempfile.mkdtemp(prefix='crop-bench-')
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+os.environ['IMAGE_STORE_DIR'] = os.path.join(workdir, 'image_store')
+os.environ['JOB_QUEUE_PATH'] = os.path.join(workdir, 'jobs.db')
+os.environ['JOB_SPOOL_DIR'] = os.path.join(workdir, 'job_spool')
+os.environ['MODEL_PATH'] = os.path.join(workdir, 'synthetic_model.h5')
+os.environ['INFERENCE_BACKEND'] = 'keras'
+os.environ.setdefault('PREDICTION_CACHE_SIZE', '0')  # measure inference, not cache hits
+
+BATCH_SIZES = [1, 8, 32, 64]
+UPLOAD_COUNTS = [1, 10, 40]
+HISTORY_ROWS = [10, 1000, 10000]
+TTA_VIEWS = [1, 4, 8]
+TTA_IMAGES = 8
+# Used when templates/ does not ship a page, so the upload and history
+# render timings always run; they still walk every history entry
+STUB_TEMPLATES = {
+    'index.html': (
+        "{{ error or '' }}<ul>{% for entry in history %}<li><img src=\"{{ entry.thumbnail_url }}\">"
+        "{{ entry.item.disease_class }} {{ entry.item.confidence_percent }}% {{ entry.item.pesticide_recommendation }}"
+        "{% for key, value in entry.details.items() %} {{ key }}: {{ value }}{% endfor %}</li>{% endfor %}</ul>"
+        "{{ next_cursor or '' }}"
+    ),
+    'login.html': '<form method="post"></form>',
+    'signup.html': '<form method="post"></form>',
+}
+
+
+def build_synthetic_model(path, num_classes):
+    from tensorflow.keras import Input, layers, models
+
+    # Same layer stack as train_model.py, random weights
+    model = models.Sequential([
+        Input(shape=(224, 224, 3)),
+        layers.Conv2D(32, (3, 3), activation='relu'),
+        layers.MaxPooling2D(2, 2),
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.MaxPooling2D(2, 2),
+        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.MaxPooling2D(2, 2),
+        layers.Flatten(),
+        layers.Dense(512, activation='relu'),
+        layers.Dropout(0.5),
+        layers.Dense(num_classes, activation='softmax'),
+    ])
+    model.save(path)
+
+
+def synthetic_image(seed, size=(1024, 768)):
+    rng = np.random.default_rng(seed)
+    # Smooth gradients plus noise compress more like a photo than pure noise
+    base = np.linspace(0, 255, size[0], dtype=np.float32)[None, :, None]
+    pixels = base + rng.normal(0, 25, (size[1], size[0], 3))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def jpeg_bytes(image):
+    buffered = io.BytesIO()
+    image.save(buffered, format='JPEG', quality=90)
+    return buffered.getvalue()
+
+
+def timed(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': statistics.median(samples),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'mean_ms': statistics.mean(samples),
+        'runs': repeat,
+    }
+
+
+def bench_inference(app_module, repeat):
+    from inference import average_views, predict_batch, preprocess_batch, preprocess_image
+
+    results = {}
+    image = synthetic_image(0)
+    results['preprocess_image'] = timed(lambda: preprocess_image(image), repeat * 5)
+
+    model = app_module.get_model()
+    single = preprocess_image(image)
+    results['predict_single'] = timed(lambda: predict_batch(model, [single], 1), repeat)
+
+    for batch_size in BATCH_SIZES:
+        batch = np.repeat(single, batch_size, axis=0)
+        entry = timed(lambda: predict_batch(model, batch, batch_size), repeat)
+        entry['images_per_sec'] = batch_size / (entry['median_ms'] / 1000)
+        results[f'predict_batch_{batch_size}'] = entry
+
+    # Test-time augmentation: preprocess every view and predict them as one batch
+    images = [synthetic_image(10 + i) for i in range(TTA_IMAGES)]
+    for views in TTA_VIEWS:
+        def tta():
+            average_views(predict_batch(model, preprocess_batch(images, None, views), TTA_IMAGES * views), views)
+        entry = timed(tta, repeat)
+        entry['images_per_sec'] = TTA_IMAGES / (entry['median_ms'] / 1000)
+        results[f'tta_{views}_views_{TTA_IMAGES}_images'] = entry
+    return results
+
+
+def bench_encoding(app_module, repeat):
+    image = synthetic_image(1)
+
+    def legacy_png_base64():
+        buffered = io.BytesIO()
+        image.save(buffered, format='PNG')
+        base64.b64encode(buffered.getvalue()).decode()
+
+    return {
+        'encode_png_base64': timed(legacy_png_base64, repeat),
+        'encode_history_images': timed(lambda: app_module.store_history_images(image), repeat),
+    }
+
+
+def login(client, username):
+    client.post('/signup', data={'username': username, 'password': 'bench'})
+    client.post('/login', data={'username': username, 'password': 'bench'})
+
+
+def history_count(app_module, username):
+    with app_module.app.app_context():
+        user = app_module.User.query.filter_by(username=username).first()
+        return app_module.PredictionHistory.query.filter_by(user_id=user.id).count()
+
+
+def bench_upload(app_module, repeat):
+    client = app_module.app.test_client()
+    login(client, 'bench-upload')
+    uploads = [jpeg_bytes(synthetic_image(100 + i)) for i in range(max(UPLOAD_COUNTS))]
+    results = {}
+    for count in UPLOAD_COUNTS:
+        def post():
+            files = [(io.BytesIO(data), f'{i}.jpg') for i, data in enumerate(uploads[:count])]
+            response = client.post('/', data={'files': files}, content_type='multipart/form-data')
+            assert response.status_code == 200, response.status_code
+        # index() renders failures as a 200 page, so only a history row per
+        # image (warm-up included) shows the uploads were really scored
+        before = history_count(app_module, 'bench-upload')
+        entry = timed(post, repeat)
+        added = history_count(app_module, 'bench-upload') - before
+        assert added == count * (repeat + 1), f"{count}-file uploads stored {added} of {count * (repeat + 1)} predictions"
+        entry['images_per_sec'] = count / (entry['median_ms'] / 1000)
+        results[f'post_index_{count}_files'] = entry
+    return results
+
+
+def seed_history(app_module, user_id, rows):
+    db, PredictionHistory = app_module.db, app_module.PredictionHistory
+    class_names = app_module.CLASS_NAMES
+    db.session.execute(PredictionHistory.__table__.insert(), [
+        {
+            'user_id': user_id,
+            'image_hash': '0' * 64,
+            'thumbnail_hash': '0' * 64,
+            'disease_class': class_names[i % len(class_names)],
+            'confidence_percent': 90.0,
+            'pesticide_recommendation': app_module.PESTICIDES[class_names[i % len(class_names)]],
+            'timestamp': app_module.utcnow(),
+        }
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+
+def bench_history(app_module, repeat):
+    results = {}
+    for rows in HISTORY_ROWS:
+        username = f'bench-history-{rows}'
+        client = app_module.app.test_client()
+        login(client, username)
+        with app_module.app.app_context():
+            user = app_module.User.query.filter_by(username=username).first()
+            seed_history(app_module, user.id, rows)
+            results[f'history_query_{rows}_rows'] = timed(lambda: app_module.history_page(user.id), repeat * 5)
+        def get():
+            response = client.get('/')
+            assert response.status_code == 200, response.status_code
+        results[f'history_render_{rows}_rows'] = timed(get, repeat * 5)
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Lower is better for latencies, higher is better for throughput
+    regressions = []
+    for name, entry in results.items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        if 'images_per_sec' in entry and 'images_per_sec' in old:
+            change = (entry['images_per_sec'] - old['images_per_sec']) / old['images_per_sec'] * 100
+            if change < -threshold:
+                regressions.append((name, 'images_per_sec', old['images_per_sec'], entry['images_per_sec'], change))
+        change = (entry['median_ms'] - old['median_ms']) / old['median_ms'] * 100
+        if change > threshold:
+            regressions.append((name, 'median_ms', old['median_ms'], entry['median_ms'], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing, inference, uploads and history rendering.")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--baseline', help="Compare against an earlier --output file")
+    parser.add_argument('--threshold', type=float, default=10.0, help="Allowed regression in percent")
+    parser.add_argument('--suites', nargs='+', choices=['inference', 'encoding', 'upload', 'history'],
+                        default=['inference', 'encoding', 'upload', 'history'])
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    import migrations
+
+    app_module.app.jinja_loader = ChoiceLoader([app_module.app.jinja_loader, DictLoader(STUB_TEMPLATES)])
+    build_synthetic_model(os.environ['MODEL_PATH'], len(app_module.CLASS_NAMES))
+    with app_module.app.app_context():
+        migrations.upgrade(app_module.db, app_module.image_store)
+
+    suites = {
+        'inference': bench_inference,
+        'encoding': bench_encoding,
+        'upload': bench_upload,
+        'history': bench_history,
+    }
+    results = {}
+    try:
+        for name in args.suites:
+            results.update(suites[name](app_module, args.repeat))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'benchmark':<34}{'median ms':>12}{'p95 ms':>12}{'images/sec':>12}")
+    for name, entry in results.items():
+        rate = f"{entry['images_per_sec']:.1f}" if 'images_per_sec' in entry else ''
+        print(f"{name:<34}{entry['median_ms']:>12.2f}{entry['p95_ms']:>12.2f}{rate:>12}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpu_count': os.cpu_count(),
+                'config': {
+                    'batching_enabled': app_module.app.config['BATCHING_ENABLED'],
+                    'max_batch_size': app_module.app.config['MAX_BATCH_SIZE'],
+                    'decode_workers': app_module.app.config['DECODE_WORKERS'],
+                },
+                'results': results,
+            }, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, metric, before, after, change in regressions:
+            print(f"REGRESSION {name} {metric}: {before:.2f} -> {after:.2f} ({change:+.1f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
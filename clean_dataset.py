@@ -1,20 +1,147 @@
+import argparse
+import hashlib
+import io
+import json
 import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
 from PIL import Image
 
-def clean_folder(folder):
+base_dir = 'dataset'
+folders = [os.path.join(base_dir, 'train'), os.path.join(base_dir, 'validation')]
+manifest_path = os.path.join(base_dir, 'clean_manifest.json')
+quarantine_dir = os.path.join(base_dir, 'quarantine')
+# Everything moved to quarantine, with the PlantVillage file it was split
+# from, so split_dataset.py does not put it back on its next run
+quarantine_list_path = os.path.join(base_dir, 'quarantined.json')
+split_manifest_path = os.path.join(base_dir, 'split_manifest.json')
+
+
+def check_file(path):
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    entry = {
+        'size': st.st_size,
+        'mtime': st.st_mtime_ns,
+        'hash': hashlib.sha256(data).hexdigest(),
+        'verdict': 'ok',
+    }
+    try:
+        # verify() only checks structure; load() does a full decode and
+        # catches truncated or otherwise undecodable files
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+    except Exception as e:
+        entry['verdict'] = 'corrupt'
+        entry['reason'] = f'{type(e).__name__}: {e}'
+    return path, entry
+
+
+def load_manifest(path=manifest_path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest, path=manifest_path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def quarantine(path, dry_run, quarantined, source, reason):
+    dst = os.path.join(quarantine_dir, os.path.relpath(path, base_dir))
+    if dry_run:
+        print("Would quarantine:", path)
+        return
+    print("Quarantining:", path, "->", dst)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.move(path, dst)
+    quarantined[path] = {'source': source, 'reason': reason}
+
+
+def scan(manifest):
+    # Yield every file with a flag telling whether it must be (re)checked
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            for file in files:
+                file_path = os.path.join(root, file)
+                st = os.stat(file_path)
+                known = manifest.get(file_path)
+                fresh = known is not None and known['size'] == st.st_size and known['mtime'] == st.st_mtime_ns
+                yield file_path, not fresh
+
+
+def split_of(path):
+    return os.path.relpath(path, base_dir).split(os.sep)[0]
+
+
+def clean(workers=None, dry_run=False, quarantine_duplicates=False):
+    manifest = load_manifest()
+    quarantined = load_manifest(quarantine_list_path)
+    sources = {entry['dst']: src for src, entry in load_manifest(split_manifest_path).items()}
+    seen = set()
+    to_check = []
+    for path, stale in scan(manifest):
+        seen.add(path)
+        if stale:
+            to_check.append(path)
+    for path in list(manifest):
+        if path not in seen:
+            del manifest[path]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, entry in pool.map(check_file, to_check, chunksize=64):
+            manifest[path] = entry
+    print(f"Checked {len(to_check)} new or changed files, {len(seen) - len(to_check)} unchanged")
+
     removed = 0
-    for root, _, files in os.walk(folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            try:
-                # Try to open the file as an image
-                with Image.open(file_path) as img:
-                    img.verify()
-            except Exception:
-                print("Removing corrupted or non-image file:", file_path)
-                removed += 1
-                os.remove(file_path)
-    print(f"Removed {removed} files from {folder}")
-
-clean_folder('dataset/train')
-clean_folder('dataset/validation')
+    for path, entry in sorted(manifest.items()):
+        if entry['verdict'] == 'corrupt':
+            print("Corrupted or non-image file:", path, f"({entry['reason']})")
+            quarantine(path, dry_run, quarantined, sources.get(path), entry['reason'])
+            removed += 1
+
+    # The same bytes in both train and validation leak into the evaluation
+    by_hash = defaultdict(list)
+    for path, entry in manifest.items():
+        if entry['verdict'] == 'ok':
+            by_hash[entry['hash']].append(path)
+    duplicates = 0
+    for paths in by_hash.values():
+        splits = {split_of(path) for path in paths}
+        if len(splits) < 2:
+            continue
+        duplicates += 1
+        print("Duplicate across splits:", ', '.join(sorted(paths)))
+        if quarantine_duplicates:
+            for path in paths:
+                if split_of(path) != 'train':
+                    quarantine(path, dry_run, quarantined, sources.get(path), 'duplicate across splits')
+                    removed += 1
+
+    for path in list(manifest):
+        if not os.path.exists(path):
+            del manifest[path]
+    save_manifest(manifest)
+    if not dry_run:
+        save_manifest(quarantined, quarantine_list_path)
+    action = "Would quarantine" if dry_run else "Quarantined"
+    print(f"{action} {removed} files, found {duplicates} images duplicated across train/validation")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate the train/validation images and quarantine bad files.")
+    parser.add_argument('--workers', type=int, default=None, help="Processes to use (default: all cores)")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be quarantined")
+    parser.add_argument('--quarantine-duplicates', action='store_true',
+                        help="Also move validation copies of images that are duplicated in train")
+    args = parser.parse_args()
+    clean(args.workers, args.dry_run, args.quarantine_duplicates)
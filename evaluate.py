@@ -0,0 +1,238 @@
+import argparse
+import csv
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app import CLASS_NAMES, CONFIDENCE_THRESHOLD, UNKNOWN_CLASS, app, decode_upload
+from inference import MAX_VIEWS, average_views, load_backend, predict_batch, preprocess_batch
+from shards import IMAGE_EXTENSIONS
+
+COLUMNS = ['path', 'true_class', 'predicted_class', 'confidence_percent', 'unknown', 'reported_class']
+
+
+def iter_images(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def iter_batches(paths, batch_size):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def directory_classes(root):
+    # Labelled the way training's flow_from_directory did: the i-th subfolder
+    # in sorted order is the model's output i, whatever the folder is called
+    classes = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    if classes and len(classes) != len(CLASS_NAMES):
+        print(f"Warning: {root} has {len(classes)} class folders but the model has {len(CLASS_NAMES)} outputs")
+    for folder in classes[len(CLASS_NAMES):]:
+        print(f"Warning: images in folder {folder!r} are not labelled")
+    renamed = [(folder, name) for folder, name in zip(classes, CLASS_NAMES) if folder != name]
+    for folder, name in renamed:
+        print(f"Warning: folder {folder!r} is labelled as output {name!r}")
+    return {folder: i for i, folder in enumerate(classes[:len(CLASS_NAMES)])}
+
+
+def true_class(root, path, class_index):
+    parts = os.path.relpath(path, root).split(os.sep)
+    return class_index.get(parts[0]) if len(parts) > 1 else None
+
+
+def load_batch(paths, pool, views=1):
+    def read(path):
+        with open(path, 'rb') as f:
+            return decode_upload(f.read())
+    images = list(pool.map(read, paths))
+    return preprocess_batch(images, pool, views)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def evaluate(model, root, batch_size, workers, writer, views=1):
+    # With views > 1 the per-image results use test-time augmentation, and
+    # the first (plain) view of each image is also scored on its own so the
+    # report can compare accuracy and latency against single-view inference
+    num_classes = len(CLASS_NAMES)
+    class_index = directory_classes(root)
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    single_confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    batch_latencies = []
+    single_latencies = []
+    batch_sizes = []
+    total = unknown = single_unknown = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(max_workers=1) as loader:
+        batches = iter_batches(iter_images(root), batch_size)
+        current = next(batches, None)
+        pending = loader.submit(load_batch, current, pool, views) if current else None
+        while pending is not None:
+            paths, batch = current, pending.result()
+            # Decode the next batch while this one is on the model
+            current = next(batches, None)
+            pending = loader.submit(load_batch, current, pool, views) if current else None
+
+            # All views of the batch in one predict call
+            t0 = time.perf_counter()
+            preds = average_views(predict_batch(model, batch, batch_size * views), views)
+            batch_latencies.append(time.perf_counter() - t0)
+            batch_sizes.append(len(paths))
+            if len(batch_latencies) == 1 and preds.shape[1] != num_classes:
+                raise SystemExit(f"The model has {preds.shape[1]} outputs but CLASS_NAMES lists {num_classes} classes")
+
+            if views > 1:
+                t0 = time.perf_counter()
+                single_preds = predict_batch(model, np.ascontiguousarray(batch[::views]), batch_size)
+                single_latencies.append(time.perf_counter() - t0)
+                for path, probs in zip(paths, single_preds):
+                    label = true_class(root, path, class_index)
+                    if label is not None:
+                        single_confusion[label, int(np.argmax(probs))] += 1
+                    single_unknown += float(np.max(probs)) * 100 < CONFIDENCE_THRESHOLD
+
+            for path, probs in zip(paths, preds):
+                index = int(np.argmax(probs))
+                confidence = float(np.max(probs)) * 100
+                is_unknown = confidence < CONFIDENCE_THRESHOLD
+                label = true_class(root, path, class_index)
+                if label is not None:
+                    confusion[label, index] += 1
+                total += 1
+                unknown += is_unknown
+                writer.writerow({
+                    'path': path,
+                    'true_class': CLASS_NAMES[label] if label is not None else '',
+                    'predicted_class': CLASS_NAMES[index],
+                    'confidence_percent': round(confidence, 2),
+                    'unknown': is_unknown,
+                    'reported_class': UNKNOWN_CLASS if is_unknown else CLASS_NAMES[index],
+                })
+    elapsed = time.perf_counter() - start
+
+    labelled = confusion.sum(axis=1)
+    per_class = {
+        name: (float(confusion[i, i] / labelled[i]) if labelled[i] else None)
+        for i, name in enumerate(CLASS_NAMES)
+    }
+    per_image_ms = [latency / n * 1000 for latency, n in zip(batch_latencies, batch_sizes)]
+    report = {
+        'images': total,
+        'labelled_images': int(labelled.sum()),
+        'accuracy': float(np.trace(confusion) / labelled.sum()) if labelled.sum() else None,
+        'unknown_rate': unknown / total if total else 0.0,
+        'confidence_threshold': CONFIDENCE_THRESHOLD,
+        'per_class_accuracy': per_class,
+        'confusion_matrix': {'labels': CLASS_NAMES, 'matrix': confusion.tolist()},
+        'throughput_images_per_sec': total / elapsed if elapsed else 0.0,
+        'wall_seconds': elapsed,
+        'batch_latency_ms': {
+            'mean': statistics.mean(batch_latencies) * 1000 if batch_latencies else 0.0,
+            'p50': percentile(batch_latencies, 50) * 1000,
+            'p95': percentile(batch_latencies, 95) * 1000,
+        },
+        'per_image_latency_ms_p50': percentile(per_image_ms, 50),
+        'views': views,
+    }
+    if views > 1:
+        single_ms = [latency / n * 1000 for latency, n in zip(single_latencies, batch_sizes)]
+        single_accuracy = float(np.trace(single_confusion) / labelled.sum()) if labelled.sum() else None
+        report['single_view'] = {
+            'accuracy': single_accuracy,
+            'unknown_rate': single_unknown / total if total else 0.0,
+            'per_image_latency_ms_p50': percentile(single_ms, 50),
+        }
+        report['tta_accuracy_delta'] = report['accuracy'] - single_accuracy if single_accuracy is not None else None
+        report['tta_latency_ratio'] = (report['per_image_latency_ms_p50'] / report['single_view']['per_image_latency_ms_p50']
+                                       if report['single_view']['per_image_latency_ms_p50'] else None)
+    return report
+
+
+class ParquetWriter:
+    # Same writerow() interface as csv.DictWriter; rows are written on close
+    def __init__(self, path):
+        import pandas  # optional dependency, only needed for Parquet output
+        self.pandas = pandas
+        self.path = path
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+    def close(self):
+        self.pandas.DataFrame(self.rows, columns=COLUMNS).to_parquet(self.path, index=False)
+
+
+def print_report(report):
+    print(f"Scored {report['images']} images in {report['wall_seconds']:.1f}s "
+          f"({report['throughput_images_per_sec']:.1f} images/sec)")
+    latency = report['batch_latency_ms']
+    print(f"Batch latency: mean {latency['mean']:.1f} ms, p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms")
+    print(f"Below {CONFIDENCE_THRESHOLD}% confidence (reported as unknown): {report['unknown_rate']:.1%}")
+    if 'single_view' in report:
+        single = report['single_view']
+        print(f"Test-time augmentation with {report['views']} views vs a single view: "
+              f"{report['per_image_latency_ms_p50']:.1f} vs {single['per_image_latency_ms_p50']:.1f} ms per image "
+              f"({report['tta_latency_ratio']:.1f}x), unknown {report['unknown_rate']:.1%} vs {single['unknown_rate']:.1%}")
+        if single['accuracy'] is not None:
+            print(f"  accuracy {report['accuracy']:.4f} vs {single['accuracy']:.4f} ({report['tta_accuracy_delta']:+.4f})")
+    if report['accuracy'] is None:
+        return
+    print(f"Accuracy on {report['labelled_images']} labelled images: {report['accuracy']:.4f}")
+    for name, accuracy in report['per_class_accuracy'].items():
+        if accuracy is not None:
+            print(f"  {name:<40}{accuracy:.4f}")
+    print("Confusion matrix (rows: true class, columns: predicted class):")
+    for name, row in zip(CLASS_NAMES, report['confusion_matrix']['matrix']):
+        if any(row):
+            print(f"  {name[:30]:<32}" + ' '.join(f'{count:>5}' for count in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a directory tree of images in batches.")
+    parser.add_argument('directory', nargs='?', default=os.path.join('dataset', 'validation'))
+    parser.add_argument('--model', default=app.config['MODEL_PATH'])
+    parser.add_argument('--backend', choices=['keras', 'tflite'], default=app.config['INFERENCE_BACKEND'])
+    parser.add_argument('--output', default='predictions.csv', help="Per-image results (.csv or .parquet)")
+    parser.add_argument('--report', help="Also write the summary report as JSON")
+    parser.add_argument('--batch-size', type=int, default=app.config['MAX_BATCH_SIZE'])
+    parser.add_argument('--workers', type=int, default=app.config['DECODE_WORKERS'])
+    parser.add_argument('--tta-views', type=int, default=app.config['TTA_VIEWS'], choices=range(1, MAX_VIEWS + 1),
+                        metavar=f'1-{MAX_VIEWS}', help="Test-time augmentation views per image (1 disables it)")
+    args = parser.parse_args()
+
+    model = load_backend(args.backend, args.model)
+    if args.output.endswith('.parquet'):
+        writer = ParquetWriter(args.output)
+        report = evaluate(model, args.directory, args.batch_size, args.workers, writer, args.tta_views)
+        writer.close()
+    else:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            report = evaluate(model, args.directory, args.batch_size, args.workers, writer, args.tta_views)
+
+    print_report(report)
+    print(f"Per-image results written to {args.output}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
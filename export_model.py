@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import random
+import time
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from inference import TFLiteBackend, preprocess_image
+from shards import get_class_names, list_files
+
+
+def load_array(path):
+    with Image.open(path) as image:
+        return preprocess_image(image.convert('RGB'))
+
+
+def convert(keras_model, quantization, calibration_paths):
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        # Full-integer weights and activations, calibrated on real validation
+        # images; inputs/outputs stay float32 so serving code is unchanged
+        def representative_dataset():
+            for path in calibration_paths:
+                yield [load_array(path)]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f"Unknown quantization: {quantization!r}")
+    return converter.convert()
+
+
+def evaluate(predict, samples, batch_size):
+    correct = 0
+    for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        batch = np.concatenate([load_array(path) for path, _ in chunk], axis=0)
+        preds = predict(batch)
+        correct += int(np.sum(np.argmax(preds, axis=1) == np.array([label for _, label in chunk])))
+    return correct / len(samples) if samples else 0.0
+
+
+def latency_ms(predict, batch, runs):
+    predict(batch)  # warm-up
+    start = time.perf_counter()
+    for _ in range(runs):
+        predict(batch)
+    return (time.perf_counter() - start) / runs * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the trained Keras model to quantised TFLite models.")
+    parser.add_argument('--model', default='crop_disease_model.h5')
+    parser.add_argument('--validation-dir', default=os.path.join('dataset', 'validation'))
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--quantization', nargs='+', choices=['float16', 'int8'], default=['float16', 'int8'])
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--eval-samples', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--latency-runs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # The same class order and image files as training and the shard packer
+    samples = list(zip(*list_files(args.validation_dir, get_class_names(args.validation_dir))))
+    if not samples:
+        parser.error(f"No images found under {args.validation_dir}")
+    rng = random.Random(args.seed)
+    calibration_paths = [path for path, _ in rng.sample(samples, min(args.calibration_samples, len(samples)))]
+    eval_samples = rng.sample(samples, min(args.eval_samples, len(samples)))
+
+    keras_model = tf.keras.models.load_model(args.model)
+    keras_predict = lambda batch: keras_model.predict(batch, batch_size=len(batch), verbose=0)
+    single = load_array(eval_samples[0][0])
+    batch = np.concatenate([load_array(path) for path, _ in eval_samples[:args.batch_size]], axis=0)
+
+    report = {'keras': {
+        'path': args.model,
+        'size_bytes': os.path.getsize(args.model),
+        'accuracy': evaluate(keras_predict, eval_samples, args.batch_size),
+        'latency_ms': latency_ms(keras_predict, single, args.latency_runs),
+        'batch_latency_ms': latency_ms(keras_predict, batch, args.latency_runs),
+    }}
+    base = report['keras']
+
+    stem = os.path.splitext(os.path.basename(args.model))[0]
+    for quantization in args.quantization:
+        path = os.path.join(args.output_dir, f'{stem}_{quantization}.tflite')
+        with open(path, 'wb') as f:
+            f.write(convert(keras_model, quantization, calibration_paths))
+        backend = TFLiteBackend(path)
+        entry = {
+            'path': path,
+            'size_bytes': os.path.getsize(path),
+            'accuracy': evaluate(backend.predict, eval_samples, args.batch_size),
+            'latency_ms': latency_ms(backend.predict, single, args.latency_runs),
+            'batch_latency_ms': latency_ms(backend.predict, batch, args.latency_runs),
+        }
+        entry['accuracy_delta'] = entry['accuracy'] - base['accuracy']
+        entry['latency_delta_ms'] = entry['latency_ms'] - base['latency_ms']
+        entry['batch_latency_delta_ms'] = entry['batch_latency_ms'] - base['batch_latency_ms']
+        report[quantization] = entry
+
+    print(f"Evaluated on {len(eval_samples)} images, batch size {len(batch)}")
+    print(f"{'model':<10}{'size KB':>10}{'accuracy':>10}{'acc delta':>11}{'1-img ms':>10}{'delta':>9}{'batch ms':>10}{'delta':>9}")
+    for name, entry in report.items():
+        print(f"{name:<10}{entry['size_bytes'] / 1024:>10.0f}{entry['accuracy']:>10.4f}"
+              f"{entry.get('accuracy_delta', 0.0):>+11.4f}{entry['latency_ms']:>10.2f}"
+              f"{entry.get('latency_delta_ms', 0.0):>+9.2f}{entry['batch_latency_ms']:>10.2f}"
+              f"{entry.get('batch_latency_delta_ms', 0.0):>+9.2f}")
+
+    report_path = os.path.join(args.output_dir, f'{stem}_export_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}")
+
+
+if __name__ == '__main__':
+    main()
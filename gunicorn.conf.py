@@ -0,0 +1,42 @@
+import gc
+import os
+
+# gunicorn -c gunicorn.conf.py app:app
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Pre-fork mode: import the app and load the model once in the master, so
+# every worker shares the weights copy-on-write instead of loading its own
+# copy. Only the TFLite backend is loaded in the master; TensorFlow does not
+# support being initialised in a parent process and then forking, so a
+# Keras model is left for each worker to load after the fork.
+preload_app = os.environ.get('PRELOAD_MODEL', '0') == '1'
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from app import models
+    model = models.live.model
+    if model.kind != 'tflite':
+        server.log.warning("PRELOAD_MODEL only applies to the tflite backend; each worker loads %s model %s itself",
+                           model.kind, model.path)
+        return
+    model.get(warm_up=False)
+    server.log.info("Loaded %s model %s (version %s) in the master in %.2fs",
+                    model.kind, model.path, models.live.version, model.load_seconds)
+    # Move everything allocated so far out of the collector's reach, so GC
+    # passes in the workers do not touch (and un-share) those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    from app import app, db, models
+    # Pooled connections must not be shared across the fork
+    with app.app_context():
+        db.engine.dispose(close=False)
+    if models.live.model.warm_up_enabled:
+        models.live.model.get()
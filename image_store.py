@@ -0,0 +1,104 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def sniff_mimetype(data):
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+class ImageStore:
+    # Content-addressed image blobs on disk. Each blob is named by the SHA-256
+    # of its bytes and sharded two directory levels deep (ab/cd/abcd...), so
+    # identical uploads are stored once and no directory grows too large.
+
+    def __init__(self, root, thumbnail_size=256, thumbnail_format='JPEG', image_max_size=1024, image_format='JPEG'):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_format = thumbnail_format
+        self.image_max_size = image_max_size
+        self.image_format = image_format
+
+    def path_for(self, digest):
+        if not DIGEST_RE.match(digest):
+            raise ValueError(f"Invalid image digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        try:
+            # A fresh mtime tells remove() the blob is about to be referenced
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def get(self, digest):
+        with open(self.path_for(digest), 'rb') as f:
+            return f.read()
+
+    def digests(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if DIGEST_RE.match(name):
+                    yield name
+
+    def remove(self, digests, grace=600):
+        # Blobs written or re-put within grace seconds are kept, since the
+        # history row that will point at them may not be committed yet
+        cutoff = time.time() - grace
+        removed = 0
+        for digest in digests:
+            path = self.path_for(digest)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def put_resized(self, image, max_size, format, quality):
+        # thumbnail() keeps the aspect ratio and never upscales
+        resized = image.copy()
+        resized.thumbnail((max_size, max_size))
+        if resized.mode != 'RGB':
+            resized = resized.convert('RGB')
+        buffered = io.BytesIO()
+        resized.save(buffered, format=format, quality=quality)
+        return self.put(buffered.getvalue())
+
+    def put_image(self, image):
+        # Downscaled copy kept for the history view, not the full upload
+        return self.put_resized(image, self.image_max_size, self.image_format, 85)
+
+    def put_thumbnail(self, image):
+        return self.put_resized(image, self.thumbnail_size, self.thumbnail_format, 80)
@@ -0,0 +1,345 @@
+import io
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+# Upper bound on how many images go through one forward pass
+MAX_BATCH_SIZE = 32
+IMG_SIZE = (224, 224)
+
+# Test-time augmentation views as (crop anchor, mirrored), in the order they
+# are added as the view count grows. View 0 is the plain squashed frame, so
+# one view is exactly the single-view path; the crops are square, keep the
+# leaf at its native aspect ratio and zoom in on off-centre subjects.
+VIEWS = [
+    (None, False),
+    ((0.5, 0.5), False),
+    (None, True),
+    ((0.0, 0.0), False),
+    ((1.0, 0.0), False),
+    ((0.0, 1.0), False),
+    ((1.0, 1.0), False),
+    ((0.5, 0.5), True),
+]
+MAX_VIEWS = len(VIEWS)
+CROP_FRACTION = 0.8
+
+
+def decode_image(data, max_size=None):
+    image = Image.open(io.BytesIO(data))
+    if max_size:
+        # For JPEGs, let libjpeg decode straight at 1/2, 1/4 or 1/8 scale
+        # while staying at least max_size on each side
+        image.draft('RGB', (max_size, max_size))
+    return image.convert('RGB')
+
+
+def view_box(size, anchor):
+    if anchor is None:
+        return None
+    width, height = size
+    side = min(width, height) * CROP_FRACTION
+    left = (width - side) * anchor[0]
+    top = (height - side) * anchor[1]
+    return (left, top, left + side, top + side)
+
+
+def preprocess_into(image, out, view=0):
+    # Resize (cropping via resize's box, so no intermediate copy), then
+    # normalise the uint8 pixels straight into a float32 slot of the
+    # caller's batch buffer, with no intermediate float copies
+    anchor, mirrored = VIEWS[view]
+    resized = image.resize(IMG_SIZE, box=view_box(image.size, anchor))
+    if mirrored:
+        resized = resized.transpose(Image.FLIP_LEFT_RIGHT)
+    np.divide(np.asarray(resized, dtype=np.uint8), np.float32(255.0), out=out)
+    return out
+
+
+def preprocess_batch(images, executor=None, views=1):
+    # views > 1 lays out each image's views next to each other:
+    # rows [i * views, (i + 1) * views) belong to images[i]
+    batch = np.empty((len(images) * views,) + IMG_SIZE + (3,), dtype=np.float32)
+    fill = lambda row: preprocess_into(images[row // views], batch[row], row % views)
+    if executor is None:
+        for row in range(len(batch)):
+            fill(row)
+    else:
+        list(executor.map(fill, range(len(batch))))
+    return batch
+
+
+def average_views(preds, views):
+    # Mean softmax over each image's views, from a preprocess_batch(views=...) batch
+    if views == 1:
+        return preds
+    return preds.reshape(-1, views, preds.shape[-1]).mean(axis=1)
+
+
+class ViewBudget:
+    # Chooses how many TTA views an upload can afford. The predict cost per
+    # view is tracked as a moving average; when scoring every view of the
+    # upload, behind the images already queued, would overrun budget_ms, the
+    # view count is cut, down to a single view under heavy load.
+
+    def __init__(self, max_views=1, budget_ms=0, alpha=0.2):
+        self.max_views = max(1, min(max_views, MAX_VIEWS))
+        self.budget = budget_ms / 1000.0
+        self.alpha = alpha
+        self.per_view = None
+        self.uploads = 0
+        self.degraded = 0
+        self._lock = threading.Lock()
+
+    def views_for(self, num_images, queued=0):
+        views = self.max_views
+        if views > 1 and self.budget > 0 and self.per_view:
+            affordable = (self.budget / self.per_view - queued) / max(1, num_images)
+            views = max(1, min(views, int(affordable)))
+        with self._lock:
+            self.uploads += 1
+            self.degraded += views < self.max_views
+        return views
+
+    def record(self, num_views, seconds):
+        if not num_views:
+            return
+        cost = seconds / num_views
+        with self._lock:
+            self.per_view = cost if self.per_view is None else self.alpha * cost + (1 - self.alpha) * self.per_view
+
+    def stats(self):
+        return {
+            'max_views': self.max_views,
+            'budget_ms': self.budget * 1000.0,
+            'per_view_ms': self.per_view * 1000.0 if self.per_view is not None else None,
+            'uploads': self.uploads,
+            'degraded': self.degraded,
+        }
+
+
+def preprocess_image(image):
+    return preprocess_batch([image])
+
+
+class TFLiteBackend:
+    # Runs an exported .tflite model with the same predict() signature the
+    # Keras model has. Prefers the standalone tflite_runtime / ai_edge_litert
+    # interpreter so serving does not need to import TensorFlow at all.
+    # Batches are padded to the next power of two and each of those sizes
+    # gets its own interpreter, allocated once, so the varying batch sizes
+    # the scheduler produces never resize and reallocate tensors.
+
+    def __init__(self, path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                from ai_edge_litert.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+        self._open = lambda: Interpreter(model_path=path, num_threads=num_threads)
+        interpreter = self._open()
+        self.input_detail = interpreter.get_input_details()[0]
+        self.output_detail = interpreter.get_output_details()[0]
+        self._spare = interpreter
+        self._interpreters = {}
+        self._lock = threading.Lock()
+
+    def _quantize(self, batch):
+        dtype = self.input_detail['dtype']
+        if dtype == np.float32:
+            return batch.astype(np.float32, copy=False)
+        scale, zero_point = self.input_detail['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output):
+        if output.dtype == np.float32:
+            return output
+        scale, zero_point = self.output_detail['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def _interpreter(self, size):
+        interpreter = self._interpreters.get(size)
+        if interpreter is None:
+            interpreter, self._spare = self._spare or self._open(), None
+            interpreter.resize_tensor_input(self.input_detail['index'], (size,) + tuple(self.input_detail['shape'][1:]))
+            interpreter.allocate_tensors()
+            self._interpreters[size] = interpreter
+        return interpreter
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        count = len(batch)
+        size = 1 << (count - 1).bit_length()
+        batch = self._quantize(batch)
+        if size != count:
+            batch = np.concatenate([batch, np.zeros((size - count,) + batch.shape[1:], dtype=batch.dtype)])
+        with self._lock:
+            interpreter = self._interpreter(size)
+            interpreter.set_tensor(self.input_detail['index'], batch)
+            interpreter.invoke()
+            return self._dequantize(interpreter.get_tensor(self.output_detail['index'])[:count])
+
+
+class LazyModel:
+    # Defers loading the backend until the first predict() (or an explicit
+    # get()), so importing the app, CLI commands and non-inference routes do
+    # not pay for TensorFlow and the weights. Optionally runs one dummy batch
+    # after loading so the first real request does not absorb graph tracing.
+
+    def __init__(self, kind, path, warm_up=True):
+        self.kind = kind
+        self.path = path
+        self.warm_up_enabled = warm_up
+        self.load_seconds = None
+        self._model = None
+        self._warm = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self, warm_up=None):
+        if warm_up is None:
+            warm_up = self.warm_up_enabled
+        if self._model is None or (warm_up and not self._warm):
+            with self._lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    self._model = load_backend(self.kind, self.path)
+                    self.load_seconds = time.perf_counter() - start
+                if warm_up and not self._warm:
+                    self.warm_up()
+        return self._model
+
+    def warm_up(self):
+        dummy = np.zeros((1,) + IMG_SIZE + (3,), dtype=np.float32)
+        self._model.predict(dummy, batch_size=1, verbose=0)
+        self._warm = True
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        return self.get().predict(batch, batch_size=batch_size, verbose=verbose)
+
+
+def load_backend(kind, path):
+    if kind == 'keras':
+        from tensorflow.keras.models import load_model
+        return load_model(path)
+    if kind == 'tflite':
+        return TFLiteBackend(path)
+    raise ValueError(f"Unknown inference backend: {kind!r}")
+
+
+def iter_chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def predict_batch(model, arrays, max_batch_size=MAX_BATCH_SIZE):
+    # arrays is either a preprocess_batch() array or a list of
+    # preprocess_image() outputs of shape (1, H, W, 3); it is run through the
+    # model in chunks of at most max_batch_size, so N uploads cost
+    # ceil(N / max_batch_size) predict calls instead of N.
+    if len(arrays) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    outputs = []
+    for chunk in iter_chunks(arrays, max(1, max_batch_size)):
+        batch = chunk if isinstance(chunk, np.ndarray) else np.concatenate(chunk, axis=0)
+        outputs.append(model.predict(batch, batch_size=len(batch), verbose=0))
+    return np.concatenate(outputs, axis=0)
+
+
+class BatchScheduler:
+    # Owns the model and coalesces preprocess_image() outputs submitted from
+    # concurrent requests into shared forward passes. A batch is flushed once
+    # it holds max_batch_size images or max_wait_ms has passed since its first
+    # image arrived, whichever comes first.
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=5):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.images = 0
+        self.max_queue_depth = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def submit(self, img_array):
+        future = Future()
+        self.start()
+        self._queue.put((img_array, future))
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return future
+
+    def stats(self):
+        fill_ratio = self.images / (self.batches * self.max_batch_size) if self.batches else 0.0
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'batches': self.batches,
+            'images': self.images,
+            'mean_batch_size': self.images / self.batches if self.batches else 0.0,
+            'fill_ratio': round(fill_ratio, 4),
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+        }
+
+    def _collect(self, first):
+        items = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the stop marker back so the loop exits after this batch
+                self._queue.put(None)
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            items = [item for item in self._collect(first) if item[1].set_running_or_notify_cancel()]
+            if not items:
+                continue
+            try:
+                batch = np.concatenate([arr for arr, _ in items], axis=0)
+                preds = self.model.predict(batch, batch_size=len(batch), verbose=0)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(items)
+            for (_, future), pred in zip(items, preds):
+                future.set_result(pred)
@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_job_status_created ON job (status, created_at);
+"""
+
+
+class JobQueue:
+    # Minimal durable job queue on SQLite, standing in for a real broker.
+    # Jobs move queued -> running -> done/failed; claiming is a single
+    # conditional UPDATE so several threads or processes can share the file.
+    # The file is only created on first use, not when the app is imported.
+
+    def __init__(self, path):
+        self.path = path
+        self.wakeup = threading.Event()
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+        return conn
+
+    def enqueue(self, payload):
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO job (id, status, payload, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(payload), time.time()),
+            )
+        self.wakeup.set()
+        return job_id
+
+    def claim(self):
+        with closing(self._connect()) as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT id, payload FROM job WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                claimed = conn.execute(
+                    "UPDATE job SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued'",
+                    (time.time(), row['id']),
+                ).rowcount
+                if claimed:
+                    return row['id'], json.loads(row['payload'])
+
+    def complete(self, job_id, result):
+        self._finish(job_id, 'done', result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, 'failed', error=error)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE job SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+
+    def requeue_stale(self, older_than):
+        # Jobs left 'running' by a worker that died are put back in the queue
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE job SET status = 'queued', started_at = NULL WHERE status = 'running' AND started_at < ?",
+                (time.time() - older_than,),
+            ).rowcount
+
+    def prune(self, older_than):
+        # Finished jobs are only kept long enough for clients to fetch results
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "DELETE FROM job WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - older_than,),
+            ).rowcount
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM job WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+
+class UploadSpool:
+    # Raw uploads waiting for their job. Unlike the content-addressed image
+    # store every upload gets its own file, so a job can delete its inputs
+    # once it finishes without affecting another job with the same image.
+
+    NAME_RE = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, name):
+        if not self.NAME_RE.match(name):
+            raise ValueError(f"Invalid spool name: {name!r}")
+        return os.path.join(self.root, name)
+
+    def put(self, data):
+        name = uuid.uuid4().hex
+        path = self.path_for(name)
+        os.makedirs(self.root, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        return name
+
+    def get(self, name):
+        with open(self.path_for(name), 'rb') as f:
+            return f.read()
+
+    def delete(self, name):
+        try:
+            os.remove(self.path_for(name))
+        except FileNotFoundError:
+            pass
+
+
+class WorkerPool:
+    # Background threads that drain a JobQueue through handler(payload).
+    # Idle workers also prune jobs finished more than retention seconds ago.
+
+    def __init__(self, job_queue, handler, workers=2, poll_interval=1.0, stale_after=600, retention=7 * 86400,
+                 prune_interval=3600):
+        self.job_queue = job_queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._pruned = None
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self.job_queue.requeue_stale(self.stale_after)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            claimed = self.job_queue.claim()
+            if claimed is None:
+                self._maybe_prune()
+                self.job_queue.wakeup.wait(self.poll_interval)
+                self.job_queue.wakeup.clear()
+                continue
+            job_id, payload = claimed
+            try:
+                result = self.handler(payload)
+            except Exception as e:
+                logging.exception("Job %s failed", job_id)
+                self.job_queue.fail(job_id, str(e))
+            else:
+                self.job_queue.complete(job_id, result)
+
+    def _maybe_prune(self):
+        with self._lock:
+            if self._pruned is not None and time.monotonic() - self._pruned < self.prune_interval:
+                return
+            self._pruned = time.monotonic()
+        try:
+            pruned = self.job_queue.prune(self.retention)
+        except sqlite3.Error:
+            logging.exception("Pruning finished jobs failed")
+            return
+        if pruned:
+            logging.info("Pruned %d finished jobs", pruned)
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# Concurrent write/read load on the history table, comparing the old write
+# path (rollback journal, synchronous=FULL, one commit per image) with the
+# current one (WAL, synchronous=NORMAL, one commit per upload). Each mode
+# runs in its own process against a fresh database, since the pragmas are
+# applied when app creates its engine.
+MODES = {
+    'before': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_BUSY_TIMEOUT_MS': '5000'},
+    'after': {},
+}
+
+
+def run_mode(mode, args):
+    import app as app_module
+    import migrations
+    from sqlalchemy.exc import OperationalError
+
+    app, db = app_module.app, app_module.db
+    with app.app_context():
+        migrations.upgrade(db, app_module.image_store)
+        users = []
+        for i in range(args.threads):
+            user = app_module.User(username=f'load-{i}', password='x')
+            db.session.add(user)
+            users.append(user)
+        db.session.commit()
+        user_ids = [user.id for user in users]
+
+    rng = np.random.default_rng(0)
+    probs = rng.random((args.images, len(app_module.CLASS_NAMES)))
+    probs /= probs.sum(axis=1, keepdims=True)
+    hashes = [('0' * 64, '0' * 64)] * args.images
+    served = app_module.models.live
+    latencies, errors, reads = [], [0], [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def write(user_id):
+        for _ in range(args.uploads):
+            start = time.perf_counter()
+            with app.app_context():
+                try:
+                    if mode == 'before':
+                        for h, p in zip(hashes, probs):
+                            db.session.add(app_module.history_row(user_id, h, p, served))
+                            db.session.commit()
+                    else:
+                        app_module.save_predictions(user_id, hashes, probs, served)
+                except OperationalError:
+                    db.session.rollback()
+                    with lock:
+                        errors[0] += 1
+                    continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    def read(user_id):
+        while not stop.is_set():
+            with app.app_context():
+                try:
+                    app_module.history_page(user_id)
+                except OperationalError:
+                    db.session.rollback()
+                    continue
+            with lock:
+                reads[0] += 1
+
+    writers = [threading.Thread(target=write, args=(user_id,)) for user_id in user_ids]
+    readers = [threading.Thread(target=read, args=(user_ids[i % len(user_ids)],)) for i in range(args.readers)]
+    start = time.perf_counter()
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    uploads = len(latencies)
+    return {
+        'mode': mode,
+        'uploads': uploads,
+        'errors': errors[0],
+        'uploads_per_sec': uploads / elapsed,
+        'images_per_sec': uploads * args.images / elapsed,
+        'reads_per_sec': reads[0] / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p95_ms': float(np.percentile(latencies, 95)) * 1000 if latencies else 0.0,
+        'wall_seconds': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent history write/read load test, before vs after the SQLite tuning.")
+    parser.add_argument('--threads', type=int, default=8, help="Concurrent uploading users")
+    parser.add_argument('--uploads', type=int, default=20, help="Uploads per user")
+    parser.add_argument('--images', type=int, default=40, help="Images per upload")
+    parser.add_argument('--readers', type=int, default=4, help="Threads paging through history meanwhile")
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--run', choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print(json.dumps(run_mode(args.run, args)))
+        return
+
+    results = []
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory(prefix='crop-load-') as workdir:
+            env = dict(os.environ, **MODES[mode])
+            env['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'load.db')
+            env['IMAGE_STORE_DIR'] = os.path.join(workdir, 'image_store')
+            env['JOB_QUEUE_PATH'] = os.path.join(workdir, 'jobs.db')
+            env['JOB_SPOOL_DIR'] = os.path.join(workdir, 'job_spool')
+            env['DB_POOL_SIZE'] = str(args.threads + args.readers)
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', mode,
+                 '--threads', str(args.threads), '--uploads', str(args.uploads),
+                 '--images', str(args.images), '--readers', str(args.readers)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<8}{'uploads/s':>11}{'images/s':>11}{'reads/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for r in results:
+        print(f"{r['mode']:<8}{r['uploads_per_sec']:>11.1f}{r['images_per_sec']:>11.1f}{r['reads_per_sec']:>10.1f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['errors']:>8}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
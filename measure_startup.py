@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Each phase runs in a fresh interpreter and prints its own timings and peak
+# RSS, so numbers are not polluted by modules an earlier phase imported.
+PHASES = {
+    'import_app': """
+import app
+""",
+    'first_login_page': """
+import app
+client = app.app.test_client()
+response = client.get('/login')
+assert response.status_code == 200, f'/login returned {response.status_code}'
+""",
+    'model_ready': """
+import app
+app.get_model()
+""",
+}
+
+HARNESS = """
+import json, resource, sys, time
+start = time.perf_counter()
+exec(compile(sys.argv[1], '<phase>', 'exec'))
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    'tensorflow_imported': 'tensorflow' in sys.modules,
+}))
+"""
+
+
+class PhaseFailed(Exception):
+    pass
+
+
+def run_phase(code):
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='3')
+    proc = subprocess.run(
+        [sys.executable, '-c', HARNESS, code],
+        capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        # The last stderr line is the exception, e.g. a missing trained model
+        lines = proc.stderr.strip().splitlines()
+        raise PhaseFailed(lines[-1] if lines else f'exit status {proc.returncode}')
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def measure(runs):
+    results = {}
+    for name, code in PHASES.items():
+        try:
+            samples = [run_phase(code) for _ in range(runs)]
+        except PhaseFailed as e:
+            results[name] = {'error': str(e)}
+            continue
+        results[name] = {
+            'seconds': statistics.median(s['seconds'] for s in samples),
+            'max_rss_mb': statistics.median(s['max_rss_mb'] for s in samples),
+            'tensorflow_imported': samples[0]['tensorflow_imported'],
+        }
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, entry in results.items():
+        if name not in baseline or 'error' in entry or 'error' in baseline[name]:
+            continue
+        for key in ('seconds', 'max_rss_mb'):
+            before, after = baseline[name][key], entry[key]
+            if before and (after - before) / before * 100 > threshold:
+                regressions.append(f"{name}.{key}: {before:.2f} -> {after:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import/startup time and peak RSS.")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--baseline', help="Compare against an earlier --output file")
+    parser.add_argument('--threshold', type=float, default=20.0, help="Allowed regression in percent")
+    args = parser.parse_args()
+
+    results = measure(args.runs)
+    for name, entry in results.items():
+        if 'error' in entry:
+            print(f"{name:<18}  FAILED: {entry['error']}")
+            continue
+        print(f"{name:<18}{entry['seconds']:>8.2f}s{entry['max_rss_mb']:>10.1f} MB"
+              f"   tensorflow imported: {entry['tensorflow_imported']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+    if any('error' in entry for entry in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond hashing up to multi-second
+# uploads of many files
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, metrics, name, help, labelnames=()):
+        self.metrics = metrics
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not self.metrics.enabled:
+            return
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, metrics, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.metrics = metrics
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not self.metrics.enabled:
+            return
+        key = tuple(labels[name] for name in self.labelnames)
+        # le is inclusive, so a value equal to a bound falls in that bucket
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += n
+                    le = format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{le} {cumulative}')
+                labels = format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    # Read from a callback at scrape time, for values other components
+    # already track (queue depth, cache hit rate, ...)
+    def __init__(self, metrics, name, help, fn):
+        self.metrics = metrics
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {float(self.fn())}']
+
+
+class Timer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    # In-process metrics registry rendered in the Prometheus text format.
+    # stage() times a named step of the hot path into a per-stage histogram
+    # and, while a request is being traced on this thread, into that
+    # request's breakdown. With enabled=False every call returns immediately.
+
+    def __init__(self, enabled=True, namespace='crop'):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._metrics = []
+        self._local = threading.local()
+        self.stage_seconds = self.histogram('stage_duration_seconds', 'Time spent in each hot-path stage.', ('stage',))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(self, f'{self.namespace}_{name}', help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self, f'{self.namespace}_{name}', help, labelnames, buckets))
+
+    def gauge(self, name, help, fn):
+        return self._add(Gauge(self, f'{self.namespace}_{name}', help, fn))
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def record(self, stage, seconds):
+        self.stage_seconds.observe(seconds, stage=stage)
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace[stage] = trace.get(stage, 0.0) + seconds
+
+    def begin_trace(self):
+        if self.enabled:
+            self._local.trace = {}
+
+    def end_trace(self):
+        trace = getattr(self._local, 'trace', None)
+        self._local.trace = None
+        return trace
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
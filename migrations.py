@@ -0,0 +1,141 @@
+import base64
+import binascii
+import logging
+
+from PIL import Image
+from sqlalchemy import bindparam, inspect, text
+
+
+def missing_columns(conn, table):
+    live = {col['name'] for col in inspect(conn).get_columns(table.name)}
+    return [col.name for col in table.columns if col.name not in live]
+
+
+def rebuild_table(conn, table):
+    # SQLite cannot relax NOT NULL or add indexed columns in place, so rename
+    # the live table, create it again from the current model and copy the
+    # shared columns across.
+    old_name = '_old_' + table.name
+    live = {col['name'] for col in inspect(conn).get_columns(table.name)}
+    indexes = conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t AND sql IS NOT NULL"),
+        {'t': table.name},
+    ).scalars().all()
+    for index_name in indexes:
+        conn.execute(text(f'DROP INDEX "{index_name}"'))
+    conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"'))
+    table.create(conn)
+    shared = ', '.join(f'"{col.name}"' for col in table.columns if col.name in live)
+    conn.execute(text(f'INSERT INTO "{table.name}" ({shared}) SELECT {shared} FROM "{old_name}"'))
+    conn.execute(text(f'DROP TABLE "{old_name}"'))
+
+
+def move_images_to_store(db, image_store, batch_size=200):
+    # Move base64 blobs out of prediction_history.image_data into the
+    # content-addressed store, leaving only the hash on each row
+    moved = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                text("SELECT id, image_data FROM prediction_history WHERE image_data IS NOT NULL LIMIT :n"),
+                {'n': batch_size},
+            ).all()
+            if not rows:
+                break
+            for row_id, image_data in rows:
+                try:
+                    digest = image_store.put(base64.b64decode(image_data))
+                except (binascii.Error, ValueError):
+                    logging.warning("Dropping undecodable image_data on prediction_history row %s", row_id)
+                    digest = None
+                conn.execute(
+                    text("UPDATE prediction_history SET image_hash = :h, image_data = NULL WHERE id = :id"),
+                    {'h': digest, 'id': row_id},
+                )
+            moved += len(rows)
+    return moved
+
+
+def backfill_thumbnails(db, image_store, batch_size=200):
+    done = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                text("SELECT DISTINCT image_hash FROM prediction_history "
+                     "WHERE image_hash IS NOT NULL AND thumbnail_hash IS NULL LIMIT :n"),
+                {'n': batch_size},
+            ).scalars().all()
+            if not rows:
+                break
+            for image_hash in rows:
+                try:
+                    with Image.open(image_store.path_for(image_hash)) as image:
+                        thumbnail_hash = image_store.put_thumbnail(image)
+                except OSError:
+                    logging.warning("Cannot build a thumbnail for missing or unreadable image %s", image_hash)
+                    thumbnail_hash = image_hash
+                conn.execute(
+                    text("UPDATE prediction_history SET thumbnail_hash = :t WHERE image_hash = :h"),
+                    {'t': thumbnail_hash, 'h': image_hash},
+                )
+            done += len(rows)
+    return done
+
+
+def sweep_images(db, image_store, digests=None, batch_size=500):
+    # Blobs are shared by every row (and user) that uploaded the same bytes,
+    # so only digests no history row points at any more are removed. With
+    # digests=None the whole store is swept.
+    with db.engine.connect() as conn:
+        if digests is None:
+            referenced = set(conn.execute(text(
+                "SELECT image_hash FROM prediction_history UNION SELECT thumbnail_hash FROM prediction_history"
+            )).scalars())
+            candidates = [digest for digest in image_store.digests() if digest not in referenced]
+        else:
+            candidates = sorted(set(digests) - {None})
+            query = text("SELECT image_hash, thumbnail_hash FROM prediction_history "
+                         "WHERE image_hash IN :d OR thumbnail_hash IN :d").bindparams(bindparam('d', expanding=True))
+            referenced = set()
+            for start in range(0, len(candidates), batch_size):
+                for row in conn.execute(query, {'d': candidates[start:start + batch_size]}):
+                    referenced.update(row)
+            candidates = [digest for digest in candidates if digest not in referenced]
+    return image_store.remove(candidates)
+
+
+def normalise_timestamps(conn):
+    # CURRENT_TIMESTAMP wrote 'YYYY-MM-DD HH:MM:SS' while SQLAlchemy binds
+    # datetimes with microseconds; keyset comparisons need a single format
+    conn.execute(text("UPDATE prediction_history SET timestamp = timestamp || '.000000' WHERE length(timestamp) = 19"))
+
+
+def upgrade(db, image_store):
+    db.create_all()
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if missing_columns(conn, table):
+                logging.info("Rebuilding table %s", table.name)
+                rebuild_table(conn, table)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        normalise_timestamps(conn)
+    moved = move_images_to_store(db, image_store)
+    backfill_thumbnails(db, image_store)
+    swept = sweep_images(db, image_store)
+    if swept:
+        logging.info("Removed %d images no history row refers to", swept)
+    if moved:
+        logging.info("Moved %d images into %s", moved, image_store.root)
+        # Give the space held by the old blobs back to the filesystem
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text('VACUUM'))
+    return moved
+
+
+if __name__ == '__main__':
+    from app import app, db, image_store
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        upgrade(db, image_store)
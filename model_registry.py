@@ -0,0 +1,336 @@
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import MAX_BATCH_SIZE, BatchScheduler, LazyModel, predict_batch
+
+VERSION_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+ARTIFACTS = {'keras': 'model.h5', 'tflite': 'model.tflite'}
+
+
+def map_class_indices(class_indices, class_names):
+    # Training labels classes by dataset folder name, which need not match
+    # the app's spelling. Both follow the sorted folder order, so folder
+    # names are renamed to the app's class names by output index.
+    if set(class_indices) <= set(class_names):
+        return class_indices
+    if len(class_indices) != len(class_names):
+        raise ValueError(f"Cannot map {len(class_indices)} trained classes onto {len(class_names)} known classes")
+    return {class_names[index]: index for index in class_indices.values()}
+
+
+class ModelRegistry:
+    # Versioned model artifacts on disk:
+    #   <root>/<version>/model.h5 (or model.tflite)
+    #   <root>/<version>/class_indices.json
+    #   <root>/<version>/metadata.json      backend, source file, creation time
+    #   <root>/live, <root>/shadow          name of the version to serve / to shadow
+    # Version directories are written under a temporary name and renamed into
+    # place, and pointers are replaced atomically, so a reader never sees a
+    # half-published model. With class_names set, only versions whose
+    # classes are all among them can be published or served.
+
+    def __init__(self, root, class_names=None):
+        self.root = root
+        self.class_names = class_names
+
+    def check_classes(self, names):
+        if self.class_names is None:
+            return
+        unknown = sorted(set(names) - set(self.class_names))
+        if unknown:
+            raise ValueError(f"Unknown class names: {', '.join(unknown)}")
+
+    def version_dir(self, version):
+        if not VERSION_RE.match(version):
+            raise ValueError(f"Invalid model version: {version!r}")
+        return os.path.join(self.root, version)
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if VERSION_RE.match(name) and os.path.exists(os.path.join(self.root, name, 'metadata.json')))
+
+    def publish(self, model_path, class_indices, version=None, metadata=None):
+        self.check_classes(class_indices)
+        backend = 'tflite' if model_path.endswith('.tflite') else 'keras'
+        version = version or time.strftime('%Y%m%d-%H%M%S')
+        final_dir = self.version_dir(version)
+        if os.path.exists(final_dir):
+            raise FileExistsError(f"Model version {version} already exists")
+        tmp_dir = os.path.join(self.root, f'.{version}.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        shutil.copy2(model_path, os.path.join(tmp_dir, ARTIFACTS[backend]))
+        with open(os.path.join(tmp_dir, 'class_indices.json'), 'w') as f:
+            json.dump(class_indices, f, indent=1)
+        with open(os.path.join(tmp_dir, 'metadata.json'), 'w') as f:
+            json.dump(dict(metadata or {}, backend=backend, source=os.path.abspath(model_path),
+                           created=time.strftime('%Y-%m-%dT%H:%M:%S')), f, indent=1)
+        os.rename(tmp_dir, final_dir)
+        return version
+
+    def info(self, version):
+        version_dir = self.version_dir(version)
+        with open(os.path.join(version_dir, 'metadata.json')) as f:
+            metadata = json.load(f)
+        with open(os.path.join(version_dir, 'class_indices.json')) as f:
+            class_indices = json.load(f)
+        return {
+            'version': version,
+            'backend': metadata['backend'],
+            'path': os.path.join(version_dir, ARTIFACTS[metadata['backend']]),
+            'class_names': sorted(class_indices, key=class_indices.get),
+            'metadata': metadata,
+        }
+
+    def pointer(self, name):
+        try:
+            with open(os.path.join(self.root, name)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def set_pointer(self, name, version):
+        path = os.path.join(self.root, name)
+        if version is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version: {version}")
+        with open(path + '.tmp', 'w') as f:
+            f.write(version + '\n')
+        os.replace(path + '.tmp', path)
+
+
+class ServedModel:
+    # One model version as served: its lazily loaded backend, the class names
+    # its outputs are indexed by and its own batch scheduler. Once retired,
+    # requests still holding it predict directly instead of restarting the
+    # drained scheduler.
+
+    def __init__(self, version, kind, path, class_names, warm_up=True, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=5):
+        self.version = version
+        self.class_names = class_names
+        self.max_batch_size = max_batch_size
+        self.model = LazyModel(kind, path, warm_up)
+        self.scheduler = BatchScheduler(self.model, max_batch_size, max_wait_ms)
+        self.retired = False
+        self._lock = threading.Lock()
+
+    def predict(self, batch, batching=True):
+        futures = None
+        if batching:
+            with self._lock:
+                if not self.retired:
+                    futures = [self.scheduler.submit(batch[i:i + 1]) for i in range(len(batch))]
+        if futures:
+            return np.stack([future.result() for future in futures])
+        return predict_batch(self.model, batch, self.max_batch_size)
+
+    def retire(self):
+        with self._lock:
+            self.retired = True
+        # Everything submitted before this point is still in the queue ahead
+        # of the stop marker, so no request loses its prediction
+        self.scheduler.stop()
+
+
+class ModelManager:
+    # Serves the registry's live version (or the fallback model when nothing
+    # is published) and hot-swaps it when the live pointer moves. The new
+    # version is loaded and warmed up on a background thread while the old
+    # one keeps serving; the swap itself is a single reference assignment.
+    # A shadow version, when set, scores a sampled fraction of batches in the
+    # background and its agreement and latency against live are logged.
+
+    def __init__(self, registry, fallback, warm_up=True, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=5,
+                 check_interval=5.0, shadow_rate=0.0, on_swap=None):
+        self.registry = registry
+        self.fallback = fallback
+        self.options = {'warm_up': warm_up, 'max_batch_size': max_batch_size, 'max_wait_ms': max_wait_ms}
+        self.check_interval = check_interval
+        self.shadow_rate = shadow_rate
+        self.on_swap = on_swap
+        self._live_pointer = registry.pointer('live')
+        self._shadow_pointer = registry.pointer('shadow')
+        try:
+            self.live = self._build(self._live_pointer)
+        except ValueError:
+            logging.exception("Cannot serve model %s, serving the fallback model", self._live_pointer)
+            self.live = self._build(None)
+        self.shadow = self._build(self._shadow_pointer) if self._shadow_pointer else None
+        self._checked = time.monotonic()
+        self._reloading = False
+        self._lock = threading.Lock()
+        self._shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+        self._shadow_pending = 0
+        self.shadow_batches = 0
+        self.shadow_images = 0
+        self.shadow_agreements = 0
+        self.shadow_skipped = 0
+        self.shadow_live_seconds = 0.0
+        self.shadow_seconds = 0.0
+
+    def _build(self, version):
+        if version is None:
+            kind, path, class_names = self.fallback
+            return ServedModel(os.path.basename(path), kind, path, class_names, **self.options)
+        info = self.registry.info(version)
+        # Refused before anything is loaded, so the current version keeps serving
+        self.registry.check_classes(info['class_names'])
+        return ServedModel(version, info['backend'], info['path'], info['class_names'], **self.options)
+
+    def check(self):
+        # Called on the request path; reads the pointer files at most once
+        # per check_interval and never blocks on loading a model
+        with self._lock:
+            if self._reloading or time.monotonic() - self._checked < self.check_interval:
+                return
+            self._checked = time.monotonic()
+            live, shadow = self.registry.pointer('live'), self.registry.pointer('shadow')
+            if live == self._live_pointer and shadow == self._shadow_pointer:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(live, shadow), name='model-reload', daemon=True).start()
+
+    def _reload(self, live, shadow):
+        try:
+            if live != self._live_pointer:
+                # Recorded up front so a version that fails to load is not retried every interval
+                self._live_pointer = live
+                self.swap(live)
+            if shadow != self._shadow_pointer:
+                self._shadow_pointer = shadow
+                self.set_shadow(shadow)
+        except Exception:
+            logging.exception("Model reload failed")
+        finally:
+            self._reloading = False
+
+    def swap(self, version):
+        start = time.perf_counter()
+        served = self._build(version)
+        served.model.get(warm_up=True)
+        old, self.live = self.live, served
+        if self.on_swap is not None:
+            self.on_swap(served)
+        old.retire()
+        logging.info("Serving model %s (was %s), loaded and warmed up in %.2fs",
+                     served.version, old.version, time.perf_counter() - start)
+
+    def set_shadow(self, version):
+        served = self._build(version) if version else None
+        if served is not None:
+            served.model.get(warm_up=True)
+        old, self.shadow = self.shadow, served
+        if old is not None:
+            old.retire()
+        logging.info("Shadowing live traffic with model %s", served.version if served else None)
+
+    def maybe_shadow(self, live, batch, live_preds, live_seconds):
+        shadow = self.shadow
+        if shadow is None or self.shadow_rate <= 0 or random.random() >= self.shadow_rate:
+            return
+        with self._lock:
+            # Shadow work is best effort and must not queue up behind live traffic
+            if self._shadow_pending >= 2:
+                self.shadow_skipped += 1
+                return
+            self._shadow_pending += 1
+        self._shadow_pool.submit(self._run_shadow, shadow, live, batch, live_preds, live_seconds)
+
+    def _run_shadow(self, shadow, live, batch, live_preds, live_seconds):
+        try:
+            start = time.perf_counter()
+            preds = shadow.predict(batch, batching=False)
+            seconds = time.perf_counter() - start
+            # Compare class names, since the two versions may index classes differently
+            agree = sum(live.class_names[int(np.argmax(a))] == shadow.class_names[int(np.argmax(b))]
+                        for a, b in zip(live_preds, preds))
+            with self._lock:
+                self.shadow_batches += 1
+                self.shadow_images += len(preds)
+                self.shadow_agreements += agree
+                self.shadow_live_seconds += live_seconds
+                self.shadow_seconds += seconds
+            logging.info("Shadow %s vs live %s: %d/%d agree, %.1f ms vs %.1f ms",
+                         shadow.version, live.version, agree, len(preds), seconds * 1000, live_seconds * 1000)
+        except Exception:
+            logging.exception("Shadow prediction with model %s failed", shadow.version)
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+
+    def stats(self):
+        batches = self.shadow_batches
+        return {
+            'live_version': self.live.version,
+            'shadow_version': self.shadow.version if self.shadow else None,
+            'shadow_rate': self.shadow_rate,
+            'shadow_batches': batches,
+            'shadow_images': self.shadow_images,
+            'shadow_skipped': self.shadow_skipped,
+            'agreement_rate': round(self.shadow_agreements / self.shadow_images, 4) if self.shadow_images else None,
+            'live_mean_ms': self.shadow_live_seconds / batches * 1000 if batches else None,
+            'shadow_mean_ms': self.shadow_seconds / batches * 1000 if batches else None,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Publish model versions and choose which one the app serves.")
+    parser.add_argument('--root', default=os.environ.get('MODEL_REGISTRY_DIR', 'models'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="List versions and the live/shadow pointers")
+    publish = commands.add_parser('publish', help="Copy a .h5 or .tflite model into the registry")
+    publish.add_argument('model_path')
+    publish.add_argument('--class-indices', required=True, help="JSON file mapping class name to output index")
+    publish.add_argument('--version')
+    publish.add_argument('--map-by-index', action='store_true',
+                         help="Rename classes to the app's class names by output index")
+    publish.add_argument('--promote', action='store_true', help="Also make it the live version")
+    promote = commands.add_parser('promote', help="Serve this version; running apps swap to it within seconds")
+    promote.add_argument('version')
+    shadow = commands.add_parser('shadow', help="Run this version in shadow mode next to the live one")
+    shadow.add_argument('version', nargs='?', help="Omit to turn shadow mode off")
+    args = parser.parse_args()
+
+    from app import CLASS_NAMES
+
+    registry = ModelRegistry(args.root, CLASS_NAMES)
+    if args.command == 'list':
+        live, shadow_version = registry.pointer('live'), registry.pointer('shadow')
+        for version in registry.versions():
+            info = registry.info(version)
+            marks = [name for name, pointer in (('live', live), ('shadow', shadow_version)) if pointer == version]
+            print(f"{version:<24}{info['backend']:<8}{len(info['class_names']):>4} classes  {info['metadata']['created']}  {' '.join(marks)}")
+    elif args.command == 'publish':
+        with open(args.class_indices) as f:
+            class_indices = json.load(f)
+        metadata = None
+        if args.map_by_index:
+            metadata = {'source_class_indices': class_indices}
+            class_indices = map_class_indices(class_indices, CLASS_NAMES)
+        version = registry.publish(args.model_path, class_indices, args.version, metadata)
+        print(f"Published {args.model_path} as {version}")
+        if args.promote:
+            registry.set_pointer('live', version)
+            print(f"{version} is now live")
+    elif args.command == 'promote':
+        registry.check_classes(registry.info(args.version)['class_names'])
+        registry.set_pointer('live', args.version)
+        print(f"{args.version} is now live")
+    elif args.command == 'shadow':
+        registry.set_pointer('shadow', args.version)
+        print(f"Shadow model: {args.version or 'off'}")
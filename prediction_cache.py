@@ -0,0 +1,126 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def dhash(image, size=8):
+    # Difference hash: compare neighbouring pixels of a tiny greyscale copy.
+    # Re-encodes, resizes and small edits of the same photo land within a
+    # few bits of each other.
+    small = image.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = small.load()
+    value = 0
+    for y in range(size):
+        for x in range(size):
+            value = (value << 1) | (pixels[x, y] > pixels[x + 1, y])
+    return value
+
+
+class PredictionCache:
+    # LRU cache of model outputs keyed by the exact upload hash, with an
+    # optional perceptual (dHash) fallback within max_distance bits. Entries
+    # expire after ttl seconds and the whole cache is dropped whenever the
+    # model file's mtime or size changes.
+
+    def __init__(self, max_entries=1024, ttl=3600, max_distance=None, model_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.model_path = model_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_stat = None
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _check_model(self):
+        # A stat() per lookup is cheap; hashing the file here would stall every
+        # request behind the lock, so (mtime, size) is the model's identity and
+        # even a touch of the file drops the cache
+        if not self.model_path:
+            return
+        try:
+            st = os.stat(self.model_path)
+        except OSError:
+            return
+        model_stat = (st.st_mtime_ns, st.st_size)
+        if model_stat == self._model_stat:
+            return
+        if self._model_stat is not None:
+            self._entries.clear()
+            self.invalidations += 1
+        self._model_stat = model_stat
+
+    def get(self, key, phash=None):
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._check_model()
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            if phash is not None and self.max_distance is not None:
+                # Keys are '<model version>:<content hash>'; requests still
+                # finishing on the previous version can store entries after a
+                # swap, and those must not answer for the new one
+                prefix = key.rpartition(':')[0]
+                for other_key, (probs, other_phash, expires) in reversed(self._entries.items()):
+                    if other_phash is None or expires <= now or other_key.rpartition(':')[0] != prefix:
+                        continue
+                    if bin(phash ^ other_phash).count('1') <= self.max_distance:
+                        self._entries.move_to_end(other_key)
+                        self.near_hits += 1
+                        return probs
+            self.misses += 1
+            return None
+
+    def put(self, key, probs, phash=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_model()
+            self._entries[key] = (probs, phash, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_model(self, model_path):
+        # A different model now serves predictions; nothing cached still applies
+        with self._lock:
+            self.model_path = model_path
+            self._model_stat = None
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'max_distance': self.max_distance,
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+dataset_dir = 'dataset'
+shard_root = os.path.join(dataset_dir, 'shards')
+
+IMAGE_SIZE = (224, 224)
+SHARD_SIZE = 1024
+INDEX_NAME = 'index.json'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+# On-disk layout, one directory per split:
+#   shards/<split>/index.json              class_indices, image size, shard list
+#   shards/<split>/shard-00000.images.npy  uint8 (N, 224, 224, 3)
+#   shards/<split>/shard-00000.labels.npy  int32 (N,)
+# Each shard lists its source files with size and mtime, so a rebuild only
+# re-packs shards whose sources changed plus any newly added images. The
+# index records unreadable files the same way, so they are only retried
+# once they change.
+
+
+def get_class_names(directory):
+    # Same ordering as flow_from_directory's class_indices
+    return sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+
+
+def list_files(directory, class_names):
+    paths, labels = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_dir, name))
+                labels.append(label)
+    return paths, labels
+
+
+def load_pixels(path):
+    try:
+        with Image.open(path) as image:
+            image.draft('RGB', IMAGE_SIZE)
+            return np.asarray(image.convert('RGB').resize(IMAGE_SIZE), dtype=np.uint8)
+    except Exception as e:
+        print(f"Skipping unreadable image {path}: {e}")
+        return None
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_index(split_dir):
+    path = os.path.join(split_dir, INDEX_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def save_index(split_dir, index):
+    path = os.path.join(split_dir, INDEX_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def shard_paths(split_dir, name):
+    return os.path.join(split_dir, name + '.images.npy'), os.path.join(split_dir, name + '.labels.npy')
+
+
+def write_shard(split_dir, name, sources, labels, pool):
+    # Returns the shard entry (None when nothing in sources was readable)
+    # and the [source, stat] pairs that were skipped
+    pixels = list(pool.map(load_pixels, sources, chunksize=16))
+    kept = [i for i, p in enumerate(pixels) if p is not None]
+    skipped = [[sources[i], file_stat(sources[i])] for i, p in enumerate(pixels) if p is None]
+    if not kept:
+        return None, skipped
+    images_path, labels_path = shard_paths(split_dir, name)
+    images = np.lib.format.open_memmap(images_path + '.tmp', mode='w+', dtype=np.uint8,
+                                       shape=(len(kept),) + IMAGE_SIZE[::-1] + (3,))
+    for row, i in enumerate(kept):
+        images[row] = pixels[i]
+    images.flush()
+    del images
+    np.save(labels_path + '.tmp.npy', np.array([labels[i] for i in kept], dtype=np.int32))
+    os.replace(images_path + '.tmp', images_path)
+    os.replace(labels_path + '.tmp.npy', labels_path)
+    return {'name': name, 'count': len(kept), 'sources': [[sources[i], file_stat(sources[i])] for i in kept]}, skipped
+
+
+def pack(split, workers=None, shard_size=SHARD_SIZE, rebuild=False):
+    directory = os.path.join(dataset_dir, split)
+    split_dir = os.path.join(shard_root, split)
+    os.makedirs(split_dir, exist_ok=True)
+
+    # Every split is labelled with train's classes, so a class folder missing
+    # from validation cannot shift the labels of the others
+    class_names = get_class_names(os.path.join(dataset_dir, 'train'))
+    paths, labels = list_files(directory, class_names)
+    label_of = dict(zip(paths, labels))
+    current = {path: file_stat(path) for path in paths}
+
+    index = load_index(split_dir)
+    # A new or renamed class shifts every label, so start over
+    reuse = not rebuild and index is not None and index['class_names'] == class_names
+    old_shards = index['shards'] if index else []
+    old_skipped = index.get('skipped', []) if reuse else []
+    if not reuse:
+        index = {'next_id': index['next_id'] if index else 0}
+    index.update({
+        'class_names': class_names,
+        'class_indices': {name: i for i, name in enumerate(class_names)},
+        'image_size': list(IMAGE_SIZE),
+    })
+
+    kept, pending = [], set(paths)
+    skipped = [[src, stat] for src, stat in old_skipped if current.get(src) == stat]
+    pending.difference_update(src for src, _ in skipped)
+    for shard in old_shards:
+        if reuse and all(current.get(src) == stat for src, stat in shard['sources']):
+            kept.append(shard)
+            pending.difference_update(src for src, _ in shard['sources'])
+        else:
+            for path in shard_paths(split_dir, shard['name']):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # Hash order mixes classes within every shard, since training shuffles
+    # shard order and rows within a shard rather than the whole dataset
+    pending = sorted(pending, key=lambda p: hashlib.sha256(p.encode()).digest())
+    packed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(pending), shard_size):
+            chunk = pending[start:start + shard_size]
+            name = f"shard-{index['next_id']:05d}"
+            shard, chunk_skipped = write_shard(split_dir, name, chunk, [label_of[p] for p in chunk], pool)
+            skipped.extend(chunk_skipped)
+            if shard is None:
+                continue
+            index['next_id'] += 1
+            kept.append(shard)
+            packed += shard['count']
+            print(f"Wrote {split}/{name} ({shard['count']} images)")
+    index['shards'] = kept
+    index['skipped'] = skipped
+    save_index(split_dir, index)
+    total = sum(shard['count'] for shard in kept)
+    print(f"{split}: {total} images in {len(kept)} shards, {packed} newly packed, {len(skipped)} unreadable")
+
+
+def open_shards(split):
+    # Memory-mapped (images, labels) per shard; nothing is read until used
+    split_dir = os.path.join(shard_root, split)
+    index = load_index(split_dir)
+    if index is None:
+        raise FileNotFoundError(f"No shard index in {split_dir}; run python shards.py first")
+    shards = []
+    for shard in index['shards']:
+        images_path, labels_path = shard_paths(split_dir, shard['name'])
+        shards.append((np.load(images_path, mmap_mode='r'), np.load(labels_path, mmap_mode='r')))
+    return index, shards
+
+
+def shards_available(split):
+    return os.path.exists(os.path.join(shard_root, split, INDEX_NAME))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack train/validation images into pre-decoded memory-mapped shards.")
+    parser.add_argument('--splits', nargs='+', default=['train', 'validation'])
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--rebuild', action='store_true', help="Ignore existing shards and pack everything again")
+    args = parser.parse_args()
+    for split in args.splits:
+        pack(split, args.workers, args.shard_size, args.rebuild)
@@ -1,41 +1,156 @@
+import argparse
+import errno
+import hashlib
+import json
 import os
 import shutil
-import random
+from concurrent.futures import ThreadPoolExecutor
 
 original_dataset_dir = 'dataset/PlantVillage'
  # Your dataset folder
 base_dir = 'dataset'                   # Base folder to create train/validation folders
 train_dir = os.path.join(base_dir, 'train')
 val_dir = os.path.join(base_dir, 'validation')
+manifest_path = os.path.join(base_dir, 'split_manifest.json')
+# Written by clean_dataset.py; those images are never placed again
+quarantine_list_path = os.path.join(base_dir, 'quarantined.json')
 
-# Create the train and validation directories if they don't exist
-for directory in [train_dir, val_dir]:
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-# Get all class folders
-for disease in os.listdir(original_dataset_dir):
-    disease_path = os.path.join(original_dataset_dir, disease)
-    if not os.path.isdir(disease_path):
-        continue
-    
-    os.makedirs(os.path.join(train_dir, disease), exist_ok=True)
-    os.makedirs(os.path.join(val_dir, disease), exist_ok=True)
-    
-    all_images = os.listdir(disease_path)
-    random.shuffle(all_images)
-    
-    split = int(len(all_images) * 0.8)
-    train_images = all_images[:split]
-    val_images = all_images[split:]
-    
-    for img in train_images:
-        src = os.path.join(disease_path, img)
-        dst = os.path.join(train_dir, disease, img)
-        shutil.copy(src, dst)
-    for img in val_images:
-        src = os.path.join(disease_path, img)
-        dst = os.path.join(val_dir, disease, img)
+FICLONE = 0x40049409  # linux/fs.h
+
+
+def is_train(disease, img, train_ratio):
+    # Stable per-image assignment: the same file always lands in the same
+    # split, and adding images never moves existing ones
+    digest = hashlib.sha256(f'{disease}/{img}'.encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 < train_ratio
+
+
+def reflink(src, dst):
+    import fcntl  # Unix only; the other modes work everywhere
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY):
+                raise
+            # Filesystem cannot share extents; fall back to a real copy
+            shutil.copyfileobj(fsrc, fdst)
+
+
+def place(src, dst, mode):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'copy':
         shutil.copy(src, dst)
+    elif mode == 'hardlink':
+        os.link(src, dst)
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+    elif mode == 'reflink':
+        reflink(src, dst)
+    else:
+        raise ValueError(f"Unknown mode: {mode!r}")
+
+
+def load_manifest(path=manifest_path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def plan(train_ratio):
+    for disease in sorted(os.listdir(original_dataset_dir)):
+        disease_path = os.path.join(original_dataset_dir, disease)
+        if not os.path.isdir(disease_path):
+            continue
+
+        os.makedirs(os.path.join(train_dir, disease), exist_ok=True)
+        os.makedirs(os.path.join(val_dir, disease), exist_ok=True)
+
+        for img in sorted(os.listdir(disease_path)):
+            src = os.path.join(disease_path, img)
+            split_dir, other_dir = (train_dir, val_dir) if is_train(disease, img, train_ratio) else (val_dir, train_dir)
+            yield src, os.path.join(split_dir, disease, img), os.path.join(other_dir, disease, img)
+
+
+def prune(manifest, sources):
+    # Split copies (and manifest entries) of images no longer in PlantVillage
+    pruned = 0
+    for src in list(manifest):
+        if src not in sources:
+            del manifest[src]
+    for directory in [train_dir, val_dir]:
+        for disease in os.listdir(directory):
+            disease_path = os.path.join(directory, disease)
+            if not os.path.isdir(disease_path):
+                continue
+            for img in os.listdir(disease_path):
+                if os.path.join(original_dataset_dir, disease, img) not in sources:
+                    os.remove(os.path.join(disease_path, img))
+                    pruned += 1
+    return pruned
+
+
+def split(train_ratio=0.8, mode='copy', workers=8):
+    for directory in [train_dir, val_dir]:
+        os.makedirs(directory, exist_ok=True)
+
+    manifest = load_manifest()
+    quarantined = load_manifest(quarantine_list_path)
+    quarantined_sources = {entry['source'] for entry in quarantined.values()}
+    todo = []
+    sources = set()
+    skipped = excluded = moved = 0
+    for src, dst, other in plan(train_ratio):
+        sources.add(src)
+        if src in quarantined_sources or dst in quarantined:
+            manifest.pop(src, None)
+            excluded += 1
+            continue
+        if os.path.lexists(other):
+            # Left by a changed split ratio or by an older split that did not
+            # keep a manifest; an image must never be in both splits
+            os.remove(other)
+            moved += 1
+        st = os.stat(src)
+        entry = {'dst': dst, 'size': st.st_size, 'mtime': st.st_mtime_ns, 'mode': mode}
+        previous = manifest.get(src)
+        if previous == entry and os.path.lexists(dst):
+            skipped += 1
+            continue
+        todo.append((src, dst, entry))
+    pruned = prune(manifest, sources)
+
+    def work(item):
+        src, dst, entry = item
+        place(src, dst, mode)
+        return src, entry
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for done, (src, entry) in enumerate(pool.map(work, todo), 1):
+            manifest[src] = entry
+            if done % 1000 == 0:
+                save_manifest(manifest)
+    save_manifest(manifest)
+    print(f"Placed {len(todo)} images ({mode}), skipped {skipped} already in place, {excluded} quarantined, "
+          f"removed {moved} copies from the other split and {pruned} whose source is gone")
+
 
-print("Dataset split is done!")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Split the PlantVillage images into train/validation folders.")
+    parser.add_argument('--train-ratio', type=float, default=0.8)
+    parser.add_argument('--mode', choices=['copy', 'hardlink', 'symlink', 'reflink'], default='copy',
+                        help="hardlink/symlink/reflink place images without duplicating their data")
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+    split(args.train_ratio, args.mode, args.workers)
+    print("Dataset split is done!")
@@ -4,46 +4,26 @@ warnings.filterwarnings("ignore", category=UserWarning, module='keras.src.traine
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
 
-import tensorflow as tf
 from tensorflow.keras import layers, models, Input
 import matplotlib.pyplot as plt
 
-dataset_dir = 'dataset'
-train_dir = os.path.join(dataset_dir, 'train')
-val_dir = os.path.join(dataset_dir, 'validation')
-
-img_height, img_width = 224, 224
-batch_size = 32
-
-# Data Generators (same as before)
-train_datagen = tf.keras.preprocessing.image.ImageDataGenerator(
-    rescale=1./255,
-    rotation_range=20,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    shear_range=0.2,
-    zoom_range=0.2,
-    horizontal_flip=True,
-    fill_mode='nearest'
-)
-
-val_datagen = tf.keras.preprocessing.image.ImageDataGenerator(rescale=1./255)
-
-train_generator = train_datagen.flow_from_directory(
-    train_dir,
-    target_size=(img_height, img_width),
-    batch_size=batch_size,
-    class_mode='categorical'
-)
+from app import CLASS_NAMES
+from model_registry import ModelRegistry, map_class_indices
+from preprocess import ThroughputCallback, img_height, img_width, make_dataset, make_shard_dataset, train_dir, val_dir
+from shards import shards_available
 
-validation_generator = val_datagen.flow_from_directory(
-    val_dir,
-    target_size=(img_height, img_width),
-    batch_size=batch_size,
-    class_mode='categorical'
-)
+# tf.data input pipelines shared with preprocess.py; pre-decoded shards from
+# shards.py are used when they have been packed
+if shards_available('train') and shards_available('validation'):
+    train_dataset = make_shard_dataset('train', training=True)
+    validation_dataset = make_shard_dataset('validation', training=False, class_names=train_dataset.class_names)
+else:
+    train_dataset = make_dataset(train_dir, training=True)
+    validation_dataset = make_dataset(val_dir, training=False, class_names=train_dataset.class_names)
+print(f"Found {train_dataset.num_images} training and {validation_dataset.num_images} validation images "
+      f"belonging to {len(train_dataset.class_names)} classes.")
 
-num_classes = len(train_generator.class_indices)
+num_classes = len(train_dataset.class_indices)
 
 # Updated model architecture - use explicit Input layer
 model = models.Sequential([
@@ -73,15 +53,26 @@ model.compile(
 epochs = 15
 
 history = model.fit(
-    train_generator,
+    train_dataset,
     epochs=epochs,
-    validation_data=validation_generator
+    validation_data=validation_dataset,
+    callbacks=[ThroughputCallback(train_dataset.num_images)]
 )
 
 model.save('crop_disease_model.h5')
 
 print("Model training complete and saved as crop_disease_model.h5")
 
+# Keep a versioned copy with its class_indices, named the way the app names
+# its classes; the app switches to it once promoted
+registry = ModelRegistry(os.environ.get('MODEL_REGISTRY_DIR', 'models'), CLASS_NAMES)
+version = registry.publish('crop_disease_model.h5', map_class_indices(train_dataset.class_indices, CLASS_NAMES), metadata={
+    'source_class_indices': train_dataset.class_indices,
+    'epochs': epochs,
+    'val_accuracy': float(history.history['val_accuracy'][-1]),
+})
+print(f"Published as model version {version}; serve it with: python model_registry.py promote {version}")
+
 # Plot training & validation accuracy values
 plt.figure(figsize=(12, 5))
 plt.subplot(1, 2, 1)